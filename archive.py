@@ -0,0 +1,64 @@
+import os
+import time
+import sqlite3
+import threading
+
+ARCHIVE_PATH = os.environ.get('YTD_ARCHIVE')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS downloads (
+    extractor TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    format TEXT NOT NULL,
+    title TEXT,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (extractor, video_id, format)
+) WITHOUT ROWID
+'''
+
+
+def format_key(quality=None, audio_bitrate=None):
+    """Archive format column for the CLI's download settings."""
+    if audio_bitrate:
+        return f'mp3-{audio_bitrate}'
+    return f'{quality}p' if quality else 'best'
+
+
+class DownloadArchive:
+    """Completed downloads indexed by (extractor, video id, format) in SQLite.
+
+    Lookups hit the primary key index, so checking an entry costs the same
+    for ten archived videos as for a hundred thousand. One connection is
+    shared between threads behind a lock; WAL mode keeps concurrent readers
+    (another sync, the sqlite3 shell) from blocking writes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(_SCHEMA)
+
+    def contains(self, extractor, video_id, fmt):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM downloads WHERE extractor = ? AND video_id = ? AND format = ?',
+                ((extractor or '').lower(), video_id, fmt)).fetchone()
+        return row is not None
+
+    def add(self, extractor, video_id, fmt, title=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?)',
+                ((extractor or '').lower(), video_id, fmt, title, time.time()))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM downloads').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
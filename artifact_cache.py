@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from video_info import VideoInfo
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+ARTIFACT_DIR = os.environ.get('YTD_ARTIFACT_CACHE', os.path.join('.cache', 'artifacts'))
+DEFAULT_MAX_BYTES = int(os.environ.get('YTD_ARTIFACT_BYTES', 20 * 1024 ** 3))
+# Staging directories only exist while an entry is published; older ones were left by a crash.
+STAGING_MAX_AGE = 3600
+
+# Info fields kept next to an artifact so a hit never needs yt-dlp.
+INFO_FIELDS = ('id', 'title', 'duration', 'duration_string', 'view_count', 'uploader', 'thumbnail')
+
+
+def artifact_key(video_id, settings):
+    """Return the cache key for a video produced with the given format/postprocessing settings.
+
+    settings is any JSON-serialisable description that fully determines the
+    output, e.g. the requested height or the target audio codec and bitrate.
+    """
+    blob = json.dumps([video_id, settings], sort_keys=True)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class CacheEntry:
+    """Handle given to a producer; path and info are set on a hit or after publish."""
+
+    def __init__(self, cache, key, path=None, info=None, keep_for=None):
+        self.cache = cache
+        self.key = key
+        self.path = path
+        self.info = info
+        self.keep_for = keep_for
+        self.hit = path is not None
+
+    def publish(self, filepath, info):
+        """Atomically move the finished file into the cache."""
+        self.path, self.info = self.cache._publish(self.key, filepath, info, self.keep_for)
+
+
+class ArtifactCache:
+    """Content-addressed store of finished downloads with a byte budget and LRU eviction.
+
+    Producers build the file wherever they like (see workspace.py);
+    publishing moves it into a staging directory next to the entries and
+    renames that into place in one step, so a reader only ever sees
+    complete files. Entries something still points at (a finished job, a
+    sidecar link, a ZIP being served) are pinned or held and skipped by
+    eviction; pins are per process.
+    """
+
+    def __init__(self, root=ARTIFACT_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._staging_root = os.path.join(root, '.staging')
+        self._lock_root = os.path.join(root, '.locks')
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._pins = {}
+        self._holds = {}
+        os.makedirs(self._staging_root, exist_ok=True)
+        os.makedirs(self._lock_root, exist_ok=True)
+        self._sweep_staging()
+
+    def _sweep_staging(self):
+        cutoff = time.time() - STAGING_MAX_AGE
+        for entry in os.scandir(self._staging_root):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                continue
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        """Return (path, info) for a complete entry, or None."""
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        path = os.path.join(entry_dir, meta['filename'])
+        if not os.path.exists(path):
+            return None
+        try:
+            os.utime(entry_dir)
+        except OSError:
+            pass
+        return path, VideoInfo.from_json(meta['info'])
+
+    @contextmanager
+    def producing(self, key, keep_for=None):
+        """Yield a CacheEntry for key, holding the key lock until the block exits.
+
+        On a hit entry.path is already set. On a miss the caller produces
+        the file and hands it to entry.publish(). With keep_for the entry is
+        pinned for that many seconds from the hit or publish.
+        """
+        with self._key_lock(key):
+            found = self.lookup(key)
+            with self._lock:
+                if found:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+            if found:
+                if keep_for:
+                    self._pin_key(key, time.time() + keep_for)
+                yield CacheEntry(self, key, *found, keep_for=keep_for)
+                return
+            yield CacheEntry(self, key, keep_for=keep_for)
+
+    def _key_of(self, path):
+        # Entry key of a file inside the cache, None for any other path
+        entry_dir = os.path.dirname(os.path.abspath(path))
+        if os.path.dirname(entry_dir) != os.path.abspath(self.root):
+            return None
+        return os.path.basename(entry_dir)
+
+    def _pin_key(self, key, until):
+        with self._lock:
+            self._pins[key] = max(self._pins.get(key, 0), until)
+
+    def pin(self, path, seconds):
+        """Keep the entry holding path from eviction for the next seconds."""
+        key = self._key_of(path)
+        if key is not None:
+            self._pin_key(key, time.time() + seconds)
+
+    def hold(self, path):
+        """Keep the entry holding path from eviction until a matching release()."""
+        key = self._key_of(path)
+        if key is not None:
+            with self._lock:
+                self._holds[key] = self._holds.get(key, 0) + 1
+
+    def release(self, path):
+        key = self._key_of(path)
+        with self._lock:
+            if self._holds.get(key, 0) > 1:
+                self._holds[key] -= 1
+            else:
+                self._holds.pop(key, None)
+
+    def _protected(self):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, until in self._pins.items() if until < now]:
+                del self._pins[key]
+            return set(self._pins) | set(self._holds)
+
+    @contextmanager
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self._lock_root, key + '.lock'), 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _publish(self, key, filepath, info, keep_for=None):
+        filename = os.path.basename(filepath)
+        staging_dir = tempfile.mkdtemp(prefix=key[:16] + '-', dir=self._staging_root)
+        try:
+            # A rename on the same filesystem, a copy from e.g. a tmpfs workspace
+            shutil.move(filepath, os.path.join(staging_dir, filename))
+            info = VideoInfo(**{k: getattr(info, k) for k in INFO_FIELDS})
+            with open(os.path.join(staging_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'filename': filename, 'info': info.to_json(), 'stored_at': time.time()}, f)
+            entry_dir = self._entry_dir(key)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(staging_dir, entry_dir)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        if keep_for:
+            self._pin_key(key, time.time() + keep_for)
+        self._evict(keep=key)
+        return os.path.join(entry_dir, filename), info
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if name.startswith('.'):
+                continue
+            entry_dir = os.path.join(self.root, name)
+            try:
+                size = sum(e.stat().st_size for e in os.scandir(entry_dir) if e.is_file())
+                entries.append((os.path.getmtime(entry_dir), size, name))
+            except OSError:
+                continue
+        return entries
+
+    def _evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        protected = self._protected()
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            if name == keep or name in protected:
+                continue
+            shutil.rmtree(self._entry_dir(name), ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        """Return hit/miss counters and current disk usage."""
+        entries = self._entries()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide artifact cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache()
+        return _cache
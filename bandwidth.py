@@ -0,0 +1,320 @@
+import os
+import time
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+
+# Bytes per second every download of the process may use together; 0 is unlimited.
+NODE_RATE = float(os.environ.get('YTD_NODE_RATE_MB', 0)) * 1024 * 1024
+# HTTP connections every download of the process may hold together.
+NODE_CONNECTIONS = int(os.environ.get('YTD_NODE_CONNECTIONS', 32))
+# Upper bound for yt-dlp's concurrent fragment downloads within one stream.
+MAX_FRAGMENT_CONCURRENCY = int(os.environ.get('YTD_FRAGMENT_CONCURRENCY', 8))
+SOCKET_TIMEOUT = int(os.environ.get('YTD_SOCKET_TIMEOUT', 300))
+DEFAULT_CONNECTIONS = 4
+MIN_BUFFER = 64 * 1024
+MAX_BUFFER = 4 * 1024 * 1024
+DEFAULT_BUFFER = 256 * 1024
+# One read covers about this much of a connection's transfer: few reads on
+# fast links, little memory held per connection on slow ones.
+BUFFER_SECONDS = 0.25
+ADAPT_INTERVAL = 1.0
+# Add a connection only while the last one raised throughput by at least this much.
+GROWTH_THRESHOLD = 1.1
+# Drop one when throughput falls this far below the best seen with fewer connections.
+SHRINK_THRESHOLD = 0.8
+# Latency this many times the lowest seen means requests are queueing somewhere.
+LATENCY_THRESHOLD = 3.0
+# The node counts as saturated above this share of NODE_RATE.
+SATURATION = 0.9
+RATE_WINDOW = 3.0
+
+
+def _host(url):
+    return urlsplit(url).netloc if url else None
+
+
+class NodeBudget:
+    """Connections and bandwidth shared by every download of the process.
+
+    Transfers lease their connections here and report the bytes they
+    receive; with a rate set, consume() throttles the readers so the node
+    as a whole stays under it. The node-wide throughput of the last few
+    seconds tells controllers whether another connection can still help,
+    and the connection count that worked best per host is kept as the
+    starting point for the next transfer from that host.
+    """
+
+    def __init__(self, rate=NODE_RATE, connections=NODE_CONNECTIONS):
+        self.rate = rate or None
+        self.connections = connections
+        self.in_use = 0
+        self.active = 0
+        self.total_bytes = 0
+        self._samples = deque()
+        self._allowance = self.rate or 0
+        self._last = time.monotonic()
+        self._hints = {}
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+
+    def lease(self, count, minimum=0):
+        """Take up to count connections, waiting until at least minimum are free."""
+        with self._released:
+            while self.connections - self.in_use < minimum:
+                self._released.wait()
+            granted = max(min(count, self.connections - self.in_use), 0)
+            self.in_use += granted
+            return granted
+
+    def release(self, count=1):
+        if not count:
+            return
+        with self._released:
+            self.in_use -= count
+            self._released.notify_all()
+
+    def start_transfer(self):
+        """Count one more transfer in the fair shares."""
+        with self._lock:
+            self.active += 1
+
+    def end_transfer(self):
+        with self._lock:
+            self.active -= 1
+
+    def record(self, nbytes):
+        """Count bytes received without throttling, e.g. by yt-dlp's own downloaders."""
+        now = time.monotonic()
+        with self._lock:
+            self.total_bytes += nbytes
+            self._samples.append((now, nbytes))
+            while self._samples and self._samples[0][0] < now - RATE_WINDOW:
+                self._samples.popleft()
+
+    def consume(self, nbytes):
+        """Count bytes received, sleeping while the node is over its rate."""
+        self.record(nbytes)
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate) - nbytes
+            self._last = now
+            wait = -self._allowance / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def throughput(self):
+        """Bytes per second received by the whole node over the last few seconds."""
+        now = time.monotonic()
+        with self._lock:
+            return sum(n for t, n in self._samples if t >= now - RATE_WINDOW) / RATE_WINDOW
+
+    def saturated(self):
+        return bool(self.rate) and self.throughput() >= self.rate * SATURATION
+
+    def fair_connections(self):
+        """Connections one active transfer may hold while the others get the same."""
+        with self._lock:
+            return max(self.connections // max(self.active, 1), 1)
+
+    def fair_rate(self):
+        """Each active transfer's share of the node rate, None when unlimited."""
+        with self._lock:
+            return self.rate / max(self.active, 1) if self.rate else None
+
+    def hint(self, url):
+        with self._lock:
+            return self._hints.get(_host(url))
+
+    def remember(self, url, connections):
+        host = _host(url)
+        if host and connections:
+            with self._lock:
+                self._hints[host] = connections
+
+    def controller(self, url=None, initial=DEFAULT_CONNECTIONS):
+        return AdaptiveController(self, url, initial)
+
+    def stats(self):
+        """Current usage, e.g. for the metrics endpoint."""
+        throughput = self.throughput()
+        with self._lock:
+            return {
+                'connections': self.in_use,
+                'max_connections': self.connections,
+                'transfers': self.active,
+                'bytes_per_second': throughput,
+                'max_bytes_per_second': self.rate or 0,
+                'bytes': self.total_bytes,
+            }
+
+
+class AdaptiveController:
+    """Tunes the connection count and read size of one transfer from what it measures.
+
+    Connections grow one at a time while each addition still raises
+    throughput, drop again when throughput falls well below the best seen
+    or latency (time to first byte) climbs, and never exceed the
+    transfer's fair share of the node budget or grow while the node is at
+    its rate. The read size follows the per-connection rate.
+    RangeDownloader asks plan() directly. yt-dlp's own downloaders read
+    their settings from ydl.params, so for them hook() measures through
+    the progress hooks and rewrites the attached params. A plain HTTP
+    stream picks up the rate limit at once and the buffer size with its
+    next request; fragmented streams copy the params when they start and
+    limit every fragment on its own, so they get a per-connection share
+    that applies from the next stream on.
+    """
+
+    def __init__(self, budget, url=None, initial=DEFAULT_CONNECTIONS):
+        self.budget = budget
+        self.url = url
+        self.target = budget.hint(url) or initial
+        self.rate = None
+        self.latency = None
+        self.min_latency = None
+        self.best_rate = None
+        self.best_connections = None
+        self.params = None
+        self.fragmented = False
+        self._streams = {}
+        self._window_bytes = 0
+        self._window_start = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        """End the streams still open and keep what was learned for the host."""
+        with self._lock:
+            filenames = list(self._streams)
+        for filename in filenames:
+            self._end_stream(filename)
+        self.budget.remember(self.url, self.best_connections)
+
+    def consume(self, nbytes):
+        self.budget.consume(nbytes)
+
+    def observe_latency(self, seconds):
+        with self._lock:
+            self.latency = seconds if self.latency is None else self.latency * 0.7 + seconds * 0.3
+            self.min_latency = seconds if self.min_latency is None else min(self.min_latency, seconds)
+
+    def plan(self, connections, rate):
+        """Connection count for the next interval, given the rate measured with connections."""
+        limit = self.budget.fair_connections()
+        saturated = self.budget.saturated()
+        with self._lock:
+            self.rate = rate
+            if self.best_rate is None or rate >= self.best_rate * GROWTH_THRESHOLD:
+                self.best_rate, self.best_connections = rate, connections
+                target = connections + 1
+            elif rate < self.best_rate * SHRINK_THRESHOLD and connections > self.best_connections:
+                target = connections - 1
+            else:
+                target = connections
+            if self.min_latency and self.latency and self.latency > self.min_latency * LATENCY_THRESHOLD:
+                target = min(target, connections - 1)
+            if saturated:
+                target = min(target, connections)
+            self.target = max(min(target, limit), 1)
+            return self.target
+
+    def buffer_size(self):
+        """Bytes to read at once on one connection."""
+        if not self.rate:
+            return DEFAULT_BUFFER
+        per_connection = self.rate / max(self.target, 1)
+        return int(min(max(per_connection * BUFFER_SECONDS, MIN_BUFFER), MAX_BUFFER))
+
+    def fragment_concurrency(self):
+        return max(min(self.target, MAX_FRAGMENT_CONCURRENCY, self.budget.fair_connections()), 1)
+
+    def ratelimit(self):
+        rate = self.budget.fair_rate()
+        if rate and self.fragmented:
+            return rate / self.fragment_concurrency()
+        return rate
+
+    def ydl_opts(self, fragmented=False):
+        """Starting options for yt-dlp; attach() the resulting params to keep them tuned."""
+        self.fragmented = fragmented
+        return {
+            'concurrent_fragment_downloads': self.fragment_concurrency(),
+            'buffersize': self.buffer_size(),
+            'ratelimit': self.ratelimit(),
+            'socket_timeout': SOCKET_TIMEOUT,
+        }
+
+    def attach(self, params):
+        """Retune this params dict (ydl.params) while yt-dlp downloads."""
+        self.params = params
+
+    def retune(self):
+        if self.params is None:
+            return
+        self.params['concurrent_fragment_downloads'] = self.fragment_concurrency()
+        self.params['buffersize'] = self.buffer_size()
+        self.params['ratelimit'] = self.ratelimit()
+
+    def hook(self, d):
+        """yt-dlp progress hook; measures the streams yt-dlp downloads itself."""
+        filename = d.get('filename')
+        if d.get('status') != 'downloading':
+            self._end_stream(filename)
+            return
+        now = time.monotonic()
+        rate = None
+        with self._lock:
+            stream = self._streams.get(filename)
+            started = stream is None
+            if started:
+                self.fragmented = d.get('fragment_count') is not None
+                if not self._streams:
+                    self._window_bytes, self._window_start = 0, now
+                stream = self._streams[filename] = [0, 0]
+            done = d.get('downloaded_bytes') or 0
+            delta = max(done - stream[0], 0)
+            stream[0] = done
+            self._window_bytes += delta
+            elapsed = now - self._window_start
+            if elapsed >= ADAPT_INTERVAL:
+                rate = self._window_bytes / elapsed
+                self._window_bytes, self._window_start = 0, now
+        if started:
+            self.budget.start_transfer()
+            # yt-dlp opens its own connections; leasing its concurrency keeps
+            # them visible to the other transfers without ever blocking here
+            stream[1] = self.budget.lease(self.fragment_concurrency())
+        self.budget.record(delta)
+        if rate is not None:
+            in_use = self.params.get('concurrent_fragment_downloads') if self.params else self.target
+            self.plan(in_use or 1, rate)
+            self.retune()
+
+    def _end_stream(self, filename):
+        with self._lock:
+            stream = self._streams.pop(filename, None)
+        if stream is not None:
+            self.budget.release(stream[1])
+            self.budget.end_transfer()
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_budget():
+    """Return the process-wide node budget."""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = NodeBudget()
+        return _budget
@@ -0,0 +1,601 @@
+"""Offline benchmarks for both frontends.
+
+Starts a local media server with synthetic content, registers a stub
+yt-dlp extractor for it and drives index.py's download_with_progress and
+yt_downloader.py's run_download (with Streamlit stubbed out). Results are
+written as JSON; pass --compare to diff against an earlier run.
+
+    python benchmark.py --size-mb 64 --output bench.json
+    python benchmark.py --compare bench.json
+
+--latency, --connection-rate and --node-rate shape the server; with
+--parallel several CLI downloads share the process's node budget
+(YTD_NODE_RATE_MB, YTD_NODE_CONNECTIONS), which shows how the adaptive
+connection counts settle.
+"""
+import os
+import re
+import sys
+import json
+import time
+import types
+import runpy
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer
+
+# Keep the benchmark's caches away from the real ones; must happen before
+# the frontend modules read their settings.
+_WORKDIR = tempfile.mkdtemp(prefix='ytd-bench-')
+os.environ.setdefault('YTD_METADATA_CACHE', os.path.join(_WORKDIR, 'metadata'))
+os.environ.setdefault('YTD_ARTIFACT_CACHE', os.path.join(_WORKDIR, 'artifacts'))
+os.environ.setdefault('YTD_WORKSPACE_DIR', os.path.join(_WORKDIR, 'work'))
+os.environ.setdefault('YTD_PROFILE_DIR', os.path.join(_WORKDIR, 'profiles'))
+
+from file_server import FileRequestHandler  # noqa: E402
+
+DURATION = 60
+SEGMENT_SIZE = 1024 * 1024
+# Regressions beyond this fraction are flagged by --compare, ignoring
+# absolute differences below the noise floor of each metric.
+REGRESSION_THRESHOLD = 0.10
+NOISE_FLOOR = {'wall_time': 0.01, 'peak_rss': 4 * 1024 * 1024, 'hook_time': 0.005}
+
+
+class TokenBucket:
+    """Blocking byte-rate limiter shared by every connection that uses it.
+
+    Starts with a full second of burst, or with none when empty is set.
+    """
+
+    def __init__(self, rate, empty=False):
+        self.rate = rate
+        self._allowance = 0 if empty else rate
+        self._last = time.time()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        while True:
+            with self._lock:
+                now = time.time()
+                self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+                self._last = now
+                if self._allowance >= amount or self._allowance >= self.rate:
+                    self._allowance -= amount
+                    return
+                wait = (amount - self._allowance) / self.rate
+            time.sleep(min(wait, 0.1))
+
+
+class StaticRegistry:
+    """FileRegistry stand-in that serves every file in one directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def get(self, name):
+        path = os.path.join(self.root, os.path.basename(name))
+        if not os.path.isfile(path):
+            return None
+        mime = 'audio/mp4' if name.endswith('.m4a') else 'video/mp4'
+        return path, name, mime
+
+
+class ShapedRequestHandler(FileRequestHandler):
+    """Range-capable static handler with optional latency and bandwidth limits."""
+
+    latency = 0.0
+    connection_rate = None
+    node_bucket = None
+    requests = 0
+
+    def _serve(self, send_body):
+        type(self).requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        super()._serve(send_body)
+
+    def _send_range(self, f, offset, count):
+        if not (self.connection_rate or self.node_bucket):
+            return super()._send_range(f, offset, count)
+        # One handler serves every request of a keep-alive connection, so its
+        # bucket limits the connection; starting empty, no piece gets a free burst
+        if self.connection_rate and getattr(self, '_bucket', None) is None:
+            self._bucket = TokenBucket(self.connection_rate, empty=True)
+        bucket = getattr(self, '_bucket', None)
+        f.seek(offset)
+        try:
+            while count > 0:
+                chunk = f.read(min(count, 64 * 1024))
+                if not chunk:
+                    break
+                for limiter in (bucket, self.node_bucket):
+                    if limiter:
+                        limiter.consume(len(chunk))
+                self.wfile.write(chunk)
+                count -= len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class MediaServer:
+    """Local HTTP server for synthetic media, with simulated latency and bandwidth."""
+
+    def __init__(self, root, latency=0.0, connection_rate=None, node_rate=None):
+        self.root = root
+        handler = type('Handler', (ShapedRequestHandler,), {
+            'registry': StaticRegistry(root),
+            'latency': latency,
+            'connection_rate': connection_rate,
+            'node_bucket': TokenBucket(node_rate) if node_rate else None,
+        })
+        self.handler = handler
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def url(self, name):
+        return f'{self.base_url}/files/{name}/{name}'
+
+
+def _ffmpeg():
+    return shutil.which('ffmpeg')
+
+
+def make_media(root, size_mb):
+    """Write the synthetic files; real encodes when ffmpeg exists, random bytes otherwise."""
+    os.makedirs(root, exist_ok=True)
+    ffmpeg = _ffmpeg()
+    specs = {
+        'progressive-360.mp4': ('640x360', True, []),
+        'dash-720.mp4': ('1280x720', True, ['-movflags', 'frag_keyframe+empty_moov']),
+        'video-1080.mp4': ('1920x1080', False, []),
+        'audio.m4a': (None, True, []),
+    }
+    kbps = max(int(size_mb * 8 * 1024 / DURATION), 64)
+    for name, (resolution, audio, extra) in specs.items():
+        path = os.path.join(root, name)
+        if ffmpeg:
+            cmd = [ffmpeg, '-y', '-loglevel', 'error']
+            if resolution:
+                cmd += ['-f', 'lavfi', '-i', f'testsrc=size={resolution}:rate=30']
+            if audio:
+                cmd += ['-f', 'lavfi', '-i', 'sine=frequency=440']
+            cmd += ['-t', str(DURATION)]
+            if resolution:
+                cmd += ['-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', f'{kbps}k']
+            if audio:
+                cmd += ['-c:a', 'aac', '-b:a', '128k']
+            subprocess.run(cmd + extra + [path], check=True)
+        else:
+            size = size_mb * 1024 * 1024 if resolution else size_mb * 1024 * 1024 // 8
+            with open(path, 'wb') as f:
+                f.write(random.randbytes(size))
+    sizes = {name: os.path.getsize(os.path.join(root, name)) for name in specs}
+    # yt-dlp's DASH downloader fetches each fragment by URL, so the
+    # fragmented file is also served as numbered segments
+    with open(os.path.join(root, 'dash-720.mp4'), 'rb') as f:
+        for i, segment in enumerate(iter(lambda: f.read(SEGMENT_SIZE), b'')):
+            with open(os.path.join(root, f'dash-720-{i:04d}.m4s'), 'wb') as out:
+                out.write(segment)
+    return sizes
+
+
+def make_extractor(server, sizes):
+    """Build a yt-dlp extractor class that maps /watch/<id> URLs to the local media."""
+    from yt_dlp.extractor.common import InfoExtractor
+
+    def fmt(format_id, name, height, vcodec, acodec, **extra):
+        return dict({
+            'format_id': format_id,
+            'url': server.url(name),
+            'ext': 'm4a' if vcodec == 'none' else 'mp4',
+            'height': height,
+            'vcodec': vcodec,
+            'acodec': acodec,
+            'filesize': sizes[name],
+            'protocol': 'http',
+            'tbr': sizes[name] * 8 / 1000 / DURATION,
+        }, **extra)
+
+    segments = (sizes['dash-720.mp4'] + SEGMENT_SIZE - 1) // SEGMENT_SIZE
+    fragments = [{'url': server.url(f'dash-720-{i:04d}.m4s')} for i in range(segments)]
+
+    class BenchIE(InfoExtractor):
+        IE_NAME = 'bench'
+        _VALID_URL = re.escape(server.base_url) + r'/watch/(?P<id>[\w-]+)'
+
+        def _real_extract(self, url):
+            video_id = self._match_id(url)
+            return {
+                'id': video_id,
+                'title': f'bench {video_id}',
+                'duration': DURATION,
+                'uploader': 'benchmark',
+                'formats': [
+                    fmt('18', 'progressive-360.mp4', 360, 'avc1.42001E', 'mp4a.40.2'),
+                    fmt('22d', 'dash-720.mp4', 720, 'avc1.4d401f', 'mp4a.40.2',
+                        protocol='http_dash_segments', fragments=fragments),
+                    fmt('137', 'video-1080.mp4', 1080, 'avc1.640028', 'none'),
+                    fmt('140', 'audio.m4a', None, 'none', 'mp4a.40.2', abr=128),
+                ],
+            }
+
+    return BenchIE
+
+
+def register_extractor(ie_class):
+    """Put ie_class in front of yt-dlp's extractor list so it wins over Generic."""
+    from yt_dlp.extractor import import_extractors
+    from yt_dlp.globals import extractors
+    import_extractors()
+    current = dict(extractors.value)
+    extractors.value.clear()
+    extractors.value[ie_class.__name__] = ie_class
+    extractors.value.update(current)
+
+
+class RssSampler:
+    """Samples resident memory in the background and keeps the peak."""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current():
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        import resource
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+class Counters:
+    """Time spent in progress hooks and ffmpeg, collected through light patches."""
+
+    def __init__(self):
+        self.hook_calls = 0
+        self.hook_time = 0.0
+        self.ffmpeg_time = 0.0
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.hook_calls, self.hook_time, self.ffmpeg_time = 0, 0.0, 0.0
+
+    def timed(self, fn, kind):
+        counters = self
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                with counters._lock:
+                    if kind == 'hook':
+                        counters.hook_calls += 1
+                        counters.hook_time += elapsed
+                    else:
+                        counters.ffmpeg_time += elapsed
+        return wrapper
+
+    def install(self):
+        import progress
+        import transcode
+        from yt_dlp.postprocessor.ffmpeg import FFmpegPostProcessor
+        progress.ProgressAggregator.hook = self.timed(progress.ProgressAggregator.hook, 'hook')
+        FFmpegPostProcessor.real_run_ffmpeg = self.timed(FFmpegPostProcessor.real_run_ffmpeg, 'ffmpeg')
+        transcode.subprocess = types.SimpleNamespace(
+            run=self.timed(subprocess.run, 'ffmpeg'), DEVNULL=subprocess.DEVNULL, PIPE=subprocess.PIPE)
+
+
+class StreamlitStub(types.ModuleType):
+    """Just enough of the streamlit API to execute yt_downloader.py headless."""
+
+    class _Element:
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: StreamlitStub._Element()
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    def __init__(self):
+        super().__init__('streamlit')
+        self.inputs = {}
+        self.query_params = {}
+        self.session_state = {}
+        self.messages = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: StreamlitStub._Element()
+
+    def columns(self, spec, **kwargs):
+        count = spec if isinstance(spec, int) else len(spec)
+        return [StreamlitStub._Element() for _ in range(count)]
+
+    def text_input(self, label, *args, **kwargs):
+        return self.inputs.get('url', '')
+
+    def radio(self, label, options, *args, **kwargs):
+        return self.inputs.get('download_type', options[0])
+
+    def selectbox(self, label, options, *args, **kwargs):
+        return self.inputs.get(label, options[0])
+
+    def fragment(self, func=None, **kwargs):
+        return func if func is not None else (lambda f: f)
+
+    def checkbox(self, label, value=False, *args, **kwargs):
+        return self.inputs.get(label, value)
+
+    def button(self, *args, **kwargs):
+        return self.inputs.get('submit', False)
+
+    def error(self, body, *args, **kwargs):
+        self.messages.append(('error', body))
+
+    def success(self, body, *args, **kwargs):
+        self.messages.append(('success', body))
+
+
+def run_cli(url, quality, audio_bitrate, output):
+    import index
+    info = index.get_video_info(url)
+    plan = index.pick_format(info, quality, audio_bitrate)
+    if audio_bitrate:
+        return index.download_audio(url, info, audio_bitrate, output)
+    hook = index.TqdmHook(leave=False)
+    return bool(index.download_with_progress(url, plan, output, info=info, hook=hook))
+
+
+def run_cli_parallel(urls, quality, audio_bitrate, output):
+    """Run one CLI download per URL at the same time; True if all succeeded."""
+    results = [False] * len(urls)
+
+    def run(i):
+        results[i] = run_cli(urls[i], quality, audio_bitrate, output)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(urls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return all(results)
+
+
+def run_streamlit(url, quality, audio_bitrate, stub, script):
+    stub.messages.clear()
+    stub.query_params.clear()
+    stub.inputs = {'url': url, 'submit': True}
+    if audio_bitrate:
+        stub.inputs['download_type'] = 'MP3 Audio'
+        stub.inputs['Audio quality:'] = next(
+            label for label in ('320kbps (Best)', '256kbps', '192kbps', '128kbps')
+            if label.startswith(str(audio_bitrate)))
+    else:
+        stub.inputs['download_type'] = 'Video'
+        stub.inputs['Select video quality:'] = {2160: '4K'}.get(quality, f'{quality}p')
+    runpy.run_path(script, run_name='__main__')
+    return any(kind == 'success' for kind, _ in stub.messages)
+
+
+def measure_reruns(url, stub, script, count):
+    """Wall time of page reruns that do not submit, e.g. after a widget change."""
+    stub.query_params.clear()
+    stub.inputs = {'url': url, 'submit': False, 'download_type': 'Video'}
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        runpy.run_path(script, run_name='__main__')
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def scenarios(has_ffmpeg):
+    yield 'progressive-360', 360, None
+    yield 'dash-720', 720, None
+    if has_ffmpeg:
+        yield 'merge-1080', 1080, None
+        yield 'mp3-192', None, 192
+
+
+def run_benchmarks(args):
+    media_dir = os.path.join(_WORKDIR, 'media')
+    sizes = make_media(media_dir, args.size_mb)
+    server = MediaServer(media_dir, args.latency, args.connection_rate, args.node_rate).start()
+    register_extractor(make_extractor(server, sizes))
+    counters = Counters()
+    counters.install()
+
+    stub = StreamlitStub()
+    sys.modules['streamlit'] = stub
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'yt_downloader.py')
+    has_ffmpeg = _ffmpeg() is not None
+    results = []
+    for frontend in args.frontends:
+        for name, quality, audio_bitrate in scenarios(has_ffmpeg):
+            for run in range(args.repeat):
+                # A fresh ID per run keeps the metadata and artifact caches cold
+                url = f'{server.base_url}/watch/{frontend}-{name}-{run}'
+                output = os.path.join(_WORKDIR, 'out', frontend, f'{name}-{run}')
+                os.makedirs(output, exist_ok=True)
+                counters.reset()
+                start = time.perf_counter()
+                parallel = args.parallel if frontend == 'cli' else 1
+                with RssSampler() as rss:
+                    if frontend == 'cli' and parallel > 1:
+                        urls = [f'{url}-{i}' for i in range(parallel)]
+                        ok = run_cli_parallel(urls, quality, audio_bitrate, output)
+                    elif frontend == 'cli':
+                        ok = run_cli(url, quality, audio_bitrate, output)
+                    else:
+                        ok = run_streamlit(url, quality, audio_bitrate, stub, script)
+                wall = time.perf_counter() - start
+                transferred = sizes['audio.m4a'] if audio_bitrate else {
+                    360: sizes['progressive-360.mp4'],
+                    720: sizes['dash-720.mp4'],
+                    1080: sizes['video-1080.mp4'] + sizes['audio.m4a'],
+                }[quality] * parallel
+                results.append({
+                    'frontend': frontend,
+                    'scenario': name,
+                    'run': run,
+                    'parallel': parallel,
+                    'ok': bool(ok),
+                    'wall_time': wall,
+                    'bytes': transferred,
+                    'bytes_per_s': transferred / wall if wall else None,
+                    'peak_rss': rss.peak,
+                    'hook_calls': counters.hook_calls,
+                    'hook_time': counters.hook_time,
+                    'ffmpeg_time': counters.ffmpeg_time if has_ffmpeg else None,
+                })
+                print(f"{frontend:9} {name:16} run {run}: {'ok' if ok else 'FAILED'} "
+                      f"{wall:6.2f}s {transferred / wall / 1024 / 1024:8.1f} MiB/s "
+                      f"rss {rss.peak / 1024 / 1024:6.1f} MiB hooks {counters.hook_calls} "
+                      f"({counters.hook_time * 1000:.1f} ms)")
+    if 'streamlit' in args.frontends:
+        # The URL was extracted above, so this measures the rerun itself
+        with RssSampler() as rss:
+            reruns = measure_reruns(url, stub, script, args.reruns)
+        for run, wall in enumerate(reruns):
+            results.append({
+                'frontend': 'streamlit', 'scenario': 'rerun', 'run': run, 'ok': True,
+                'wall_time': wall, 'bytes': 0, 'bytes_per_s': None, 'peak_rss': rss.peak,
+                'hook_calls': 0, 'hook_time': 0.0, 'ffmpeg_time': None,
+            })
+        print(f"streamlit rerun            x{len(reruns)}: mean {sum(reruns) / len(reruns) * 1000:.1f} ms, "
+              f"max {max(reruns) * 1000:.1f} ms")
+    server.stop()
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'yt_dlp': _yt_dlp_version(),
+        'ffmpeg': has_ffmpeg,
+        'settings': {
+            'size_mb': args.size_mb,
+            'latency': args.latency,
+            'connection_rate': args.connection_rate,
+            'node_rate': args.node_rate,
+            'parallel': args.parallel,
+            'repeat': args.repeat,
+            'reruns': args.reruns,
+        },
+        'results': results,
+    }
+
+
+def _yt_dlp_version():
+    from yt_dlp.version import __version__
+    return __version__
+
+
+def summarise(report):
+    """Median wall time and throughput per frontend/scenario."""
+    groups = {}
+    for r in report['results']:
+        groups.setdefault((r['frontend'], r['scenario']), []).append(r)
+    summary = {}
+    for key, runs in groups.items():
+        walls = sorted(r['wall_time'] for r in runs)
+        summary['/'.join(key)] = {
+            'wall_time': walls[len(walls) // 2],
+            'peak_rss': max(r['peak_rss'] for r in runs),
+            'hook_time': sum(r['hook_time'] for r in runs) / len(runs),
+            'failures': sum(not r['ok'] for r in runs),
+        }
+    return summary
+
+
+def compare(old, new):
+    """Print per-scenario deltas; returns True when something regressed."""
+    before, after = summarise(old), summarise(new)
+    regressed = False
+    for key in sorted(after):
+        if key not in before:
+            continue
+        for metric in NOISE_FLOOR:
+            a, b = before[key][metric], after[key][metric]
+            if not a:
+                continue
+            change = (b - a) / a
+            flag = ''
+            if change > REGRESSION_THRESHOLD and b - a > NOISE_FLOOR[metric]:
+                flag = '  REGRESSION'
+                regressed = True
+            print(f'{key:28} {metric:10} {a:12.4g} -> {b:12.4g} ({change:+.1%}){flag}')
+        if after[key]['failures'] > before[key]['failures']:
+            print(f'{key:28} more failures than before  REGRESSION')
+            regressed = True
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for both downloader frontends")
+    parser.add_argument('--size-mb', type=int, default=32, help="approximate size of each synthetic video")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--frontends', nargs='+', default=['cli', 'streamlit'], choices=['cli', 'streamlit'])
+    parser.add_argument('--reruns', type=int, default=20, help="Streamlit reruns to time without submitting")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--connection-rate', type=float, help="bytes/s limit per connection")
+    parser.add_argument('--node-rate', type=float, help="bytes/s limit shared by all connections")
+    parser.add_argument('--parallel', type=int, default=1, help="concurrent downloads per CLI scenario")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='OLD_JSON', help="compare against an earlier results file")
+    args = parser.parse_args()
+
+    try:
+        report = run_benchmarks(args)
+    finally:
+        shutil.rmtree(_WORKDIR, ignore_errors=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            old = json.load(f)
+        sys.exit(1 if compare(old, report) else 0)
+
+
+if __name__ == '__main__':
+    main()
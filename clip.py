@@ -0,0 +1,99 @@
+import re
+import shutil
+
+_TIME_RE = re.compile(r'^(?:(\d+):)??(?:(\d+):)?(\d+(?:\.\d+)?)$')
+
+
+def parse_time(text):
+    """Seconds from '90', '1:30' or '1:02:03.5'; None for empty input."""
+    text = (text or '').strip()
+    if not text:
+        return None
+    match = _TIME_RE.match(text)
+    if not match:
+        raise ValueError(f"Invalid time '{text}', use seconds, MM:SS or HH:MM:SS")
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds)
+
+
+def _label_time(seconds):
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    return (f'{hours}h' if hours else '') + f'{rest // 60:02d}m{rest % 60:02d}s'
+
+
+def can_clip():
+    """Whether clips can be cut; ffmpeg reads the window straight from the source."""
+    return shutil.which('ffmpeg') is not None
+
+
+class ClipSpec:
+    """A window of one video: explicit start/end times, or a chapter matched by name.
+
+    yt-dlp hands the window to ffmpeg, which seeks in the remote file with
+    range requests (or skips DASH/HLS segments), so only the part covering
+    the clip is transferred. Cuts are stream copies that snap to keyframes;
+    precise=True re-encodes to cut exactly at the requested times.
+    """
+
+    def __init__(self, start=None, end=None, chapter=None, precise=False):
+        self.start = start
+        self.end = end
+        self.chapter = chapter or None
+        self.precise = precise
+        if start is not None and end is not None and end <= start:
+            raise ValueError("The clip end must be after its start")
+
+    @classmethod
+    def parse(cls, start=None, end=None, chapter=None, precise=False):
+        """Build from user input; None when no window was given."""
+        start, end, chapter = parse_time(start), parse_time(end), (chapter or '').strip()
+        if start is None and end is None and not chapter:
+            return None
+        return cls(start, end, chapter, precise)
+
+    def key(self):
+        """JSON-serialisable settings; ClipSpec(**key) recreates the clip."""
+        return {'start': self.start, 'end': self.end, 'chapter': self.chapter, 'precise': self.precise}
+
+    def resolve(self, info):
+        """(start, end) in seconds for a VideoInfo; end is None for 'until the end'."""
+        if self.chapter:
+            needle = self.chapter.lower()
+            for start, end, title in info.chapters:
+                if needle in (title or '').lower():
+                    return start or 0, end
+            hint = '' if info.chapters else ' (this video has no chapters)'
+            raise ValueError(f"No chapter matching '{self.chapter}'{hint}")
+        start, end = self.start or 0, self.end
+        if info.duration:
+            if start >= info.duration:
+                raise ValueError("The clip starts after the end of the video")
+            if end is not None and end >= info.duration:
+                end = None
+        return start, end
+
+    def length(self, info):
+        """Seconds covered by the clip, None if the video length is unknown."""
+        start, end = self.resolve(info)
+        end = end if end is not None else info.duration
+        return end - start if end is not None else None
+
+    def fraction(self, info):
+        """Share of the whole video, used to scale size estimates."""
+        length = self.length(info)
+        return min(length / info.duration, 1.0) if length is not None and info.duration else 1.0
+
+    def label(self, info):
+        """Window as text that is safe in file names, e.g. '01m30s-02m00s'."""
+        start, end = self.resolve(info)
+        return f"{_label_time(start)}-{_label_time(end) if end is not None else 'end'}"
+
+    def ydl_opts(self, info):
+        """Options that make yt-dlp download only this window."""
+        from yt_dlp.utils import download_range_func
+        start, end = self.resolve(info)
+        return {
+            'download_ranges': download_range_func(None, [(start, end if end is not None else float('inf'))]),
+            'force_keyframes_at_cuts': self.precise,
+        }
@@ -0,0 +1,191 @@
+import os
+import re
+import time
+import secrets
+import threading
+import mimetypes
+from urllib.parse import quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import get_metrics
+
+SIDECAR_HOST = os.environ.get('YTD_SIDECAR_HOST', '0.0.0.0')
+SIDECAR_PORT = int(os.environ.get('YTD_SIDECAR_PORT', 8502))
+# Address the browser uses to reach the sidecar, e.g. behind a reverse proxy.
+SIDECAR_URL = os.environ.get('YTD_SIDECAR_URL', f'http://localhost:{SIDECAR_PORT}')
+# Files above this size are linked to the sidecar instead of st.download_button.
+STREAM_THRESHOLD = int(os.environ.get('YTD_STREAM_THRESHOLD_MB', 100)) * 1024 * 1024
+LINK_TTL = int(os.environ.get('YTD_SIDECAR_LINK_TTL', 6 * 3600))
+CHUNK_SIZE = 1024 * 1024
+
+_RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+class FileRegistry:
+    """Maps unguessable tokens to files (or streams) the sidecar may serve."""
+
+    def __init__(self, ttl=LINK_TTL):
+        self.ttl = ttl
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def add(self, path, filename=None, mime=None):
+        token = secrets.token_urlsafe(16)
+        filename = filename or os.path.basename(path)
+        mime = mime or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        with self._lock:
+            self._expire()
+            self._files[token] = (path, filename, mime, time.time() + self.ttl)
+        return token
+
+    def get(self, token):
+        with self._lock:
+            entry = self._files.get(token)
+            if entry is None or entry[3] < time.time():
+                return None
+            return entry[:3]
+
+    def _expire(self):
+        now = time.time()
+        for token in [t for t, e in self._files.items() if e[3] < now]:
+            del self._files[token]
+
+
+class FileRequestHandler(BaseHTTPRequestHandler):
+    """Serves registered files from disk with Range support, one chunk at a time.
+
+    Registered streams (see stream_pipe.PipedStream) are served under
+    /stream/ and produce their bytes while the client reads them, and
+    /metrics answers with the process metrics in Prometheus text format.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    registry = None
+    streams = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def content_disposition(self, filename):
+        return f"attachment; filename*=UTF-8''{quote(filename)}"
+
+    def _serve(self, send_body):
+        parts = self.path.split('?', 1)[0].strip('/').split('/')
+        if parts == ['metrics']:
+            self._send_metrics(send_body)
+            return
+        if len(parts) >= 2 and parts[0] == 'stream' and self.streams is not None:
+            stream = self.streams.get(parts[1])
+            if stream is None:
+                self.send_error(404)
+                return
+            stream[0].serve(self, send_body)
+            return
+        entry = self.registry.get(parts[1]) if len(parts) >= 2 and parts[0] == 'files' else None
+        if entry is None:
+            self.send_error(404)
+            return
+        path, filename, mime = entry
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(404)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            start, end = 0, size - 1
+            status = 200
+            range_header = self.headers.get('Range')
+            if range_header:
+                match = _RANGE_RE.match(range_header.strip())
+                if match and (match.group(1) or match.group(2)):
+                    if match.group(1):
+                        start = int(match.group(1))
+                        if match.group(2):
+                            end = min(int(match.group(2)), size - 1)
+                    else:
+                        start = max(size - int(match.group(2)), 0)
+                    if start > end or start >= size:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f'bytes */{size}')
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    status = 206
+            length = end - start + 1 if size else 0
+            self.send_response(status)
+            self.send_header('Content-Type', mime)
+            self.send_header('Content-Length', str(length))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Disposition', self.content_disposition(filename))
+            if status == 206:
+                self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            self.end_headers()
+            if send_body and length:
+                self._send_range(f, start, length)
+
+    def _send_metrics(self, send_body):
+        body = get_metrics().render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def _send_range(self, f, offset, count):
+        self.wfile.flush()
+        try:
+            # socket.sendfile uses os.sendfile where the platform has it and
+            # falls back to chunked reads otherwise; memory stays at one chunk.
+            while count > 0:
+                sent = self.connection.sendfile(f, offset, min(count, CHUNK_SIZE * 16))
+                if not sent:
+                    break
+                offset += sent
+                count -= sent
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+_registry = FileRegistry()
+_streams = FileRegistry()
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_server(host=SIDECAR_HOST, port=SIDECAR_PORT):
+    """Start the sidecar in a daemon thread once per process."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            handler = type('Handler', (FileRequestHandler,), {'registry': _registry, 'streams': _streams})
+            _server = ThreadingHTTPServer((host, port), handler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='file-sidecar', daemon=True).start()
+        return _server
+
+
+def file_url(path, filename=None, mime=None):
+    """Register path with the sidecar and return the URL the browser should open."""
+    start_server()
+    filename = filename or os.path.basename(path)
+    token = _registry.add(os.path.abspath(path), filename, mime)
+    return f"{SIDECAR_URL.rstrip('/')}/files/{token}/{quote(filename)}"
+
+
+def stream_url(stream):
+    """Register a PipedStream with the sidecar and return the URL that starts it."""
+    start_server()
+    token = _streams.add(stream, stream.filename, stream.mime)
+    return f"{SIDECAR_URL.rstrip('/')}/stream/{token}/{quote(stream.filename)}"
+
+
+def should_stream(path):
+    """Whether a file is large enough to be served by the sidecar."""
+    return os.path.getsize(path) >= STREAM_THRESHOLD
@@ -0,0 +1,216 @@
+import shutil
+from collections import defaultdict
+
+# Video codecs that can be stream-copied into an MP4 container.
+MP4_VIDEO_CODECS = ('avc', 'hev', 'hvc', 'av01')
+# Audio codecs that can be stream-copied into an MP4/M4A container.
+MP4_AUDIO_CODECS = ('mp4a', 'aac', 'mp3')
+AUDIO_EXTS = {'mp3': 'mp3', 'aac': 'm4a', 'm4a': 'm4a'}
+
+
+def _has(codec):
+    # Missing codec fields mean unknown, not absent
+    return codec != 'none'
+
+
+def _codec_in(codec, families):
+    return bool(codec) and codec.lower().startswith(families)
+
+
+def estimate_size(f, duration=None):
+    """Bytes for one format from filesize, filesize_approx or bitrate x duration."""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        return int(size)
+    bitrate = f.get('tbr') or ((f.get('vbr') or 0) + (f.get('abr') or 0))
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+
+class FormatPlan:
+    """What to download for one job and which ffmpeg steps it needs."""
+
+    def __init__(self, video=None, audio=None, container='mp4', remux=False,
+                 transcode=False, postprocessors=None, filesize=None, output_size=None,
+                 codec=None, bitrate=None):
+        self.video = video
+        self.audio = audio
+        self.container = container
+        self.codec = codec
+        self.bitrate = bitrate
+        self.remux = remux
+        self.transcode = transcode
+        self.postprocessors = postprocessors or []
+        self.filesize = filesize
+        self.output_size = output_size or filesize
+
+    @property
+    def formats(self):
+        return [f for f in (self.video, self.audio) if f is not None]
+
+    @property
+    def format_id(self):
+        return '+'.join(f['format_id'] for f in self.formats)
+
+    @property
+    def merge(self):
+        return len(self.formats) > 1
+
+    @property
+    def height(self):
+        return (self.video or {}).get('height')
+
+    @property
+    def ext(self):
+        """Extension of the finished file."""
+        return self.container
+
+    def disk_bytes(self):
+        """Peak disk use: the downloaded streams, plus the output while ffmpeg still has them open."""
+        if not self.filesize:
+            return None
+        if self.merge or self.remux or self.transcode or self.postprocessors:
+            return self.filesize + (self.output_size or self.filesize)
+        return self.filesize
+
+    def describe(self):
+        if self.transcode:
+            source = (self.audio or {}).get('acodec', 'audio').split('.')[0]
+            return f'{self.container.upper()} (transcoded from {source})'
+        steps = 'merged by stream copy' if self.merge else 'remuxed by stream copy' if self.remux else 'no conversion'
+        return f'{self.container.upper()}, {steps}'
+
+    def ydl_opts(self, postprocess=True):
+        """Options that make yt-dlp download exactly this plan.
+
+        With postprocess=False the ffmpeg steps are left to the caller, e.g.
+        the transcoding pipeline.
+        """
+        opts = {'format': self.format_id}
+        if self.merge:
+            opts['merge_output_format'] = self.container
+        if postprocess and self.postprocessors:
+            opts['postprocessors'] = [dict(pp) for pp in self.postprocessors]
+        return opts
+
+
+class FormatIndex:
+    """Formats of one video indexed once by height, codec, container and bitrate."""
+
+    def __init__(self, formats, duration=None, can_merge=None):
+        self.duration = duration
+        self.can_merge = shutil.which('ffmpeg') is not None if can_merge is None else can_merge
+        self.combined = defaultdict(list)
+        self.video_only = defaultdict(list)
+        self.audio_only = []
+        for f in formats:
+            has_video, has_audio = _has(f.get('vcodec')), _has(f.get('acodec'))
+            if f.get('ext') in ('mhtml', None) or not (has_video or has_audio):
+                continue
+            height = f.get('height')
+            if has_video and has_audio:
+                self.combined[height].append(f)
+            elif has_video:
+                self.video_only[height].append(f)
+            elif has_audio:
+                self.audio_only.append(f)
+        self.audio_only.sort(key=lambda f: f.get('abr') or f.get('tbr') or 0)
+
+    @classmethod
+    def from_info(cls, info, **kwargs):
+        return cls(info.formats or [info.fields()], duration=info.duration, **kwargs)
+
+    def _size(self, f):
+        return estimate_size(f, self.duration)
+
+    def heights(self, progressive_only=False, container=None):
+        """Available video heights, highest first."""
+        found = set()
+        for height, formats in self.combined.items():
+            if container is None or any(f.get('ext') == container for f in formats):
+                found.add(height)
+        if not progressive_only and self.can_merge:
+            found.update(self.video_only)
+        return sorted(found, key=lambda h: h or 0, reverse=True)
+
+    def _cheapest(self, formats, container):
+        # Right container first, then smallest transfer at this height
+        return min(formats, key=lambda f: (
+            f.get('ext') != container,
+            not _codec_in(f.get('vcodec'), MP4_VIDEO_CODECS),
+            self._size(f) or float('inf'),
+        ))
+
+    def _mp4_audio(self):
+        compatible = [f for f in self.audio_only if _codec_in(f.get('acodec'), MP4_AUDIO_CODECS)]
+        return (compatible or self.audio_only or [None])[-1]
+
+    def plan_video(self, max_height=None, container='mp4', exact=False):
+        """Plan the largest video not above max_height with the fewest bytes and no re-encode."""
+        heights = [h for h in self.heights() if not exact or h == max_height]
+        fitting = [h for h in heights if max_height is None or (h or 0) <= max_height]
+        if not fitting:
+            if exact or not heights:
+                return None
+            fitting = heights[-1:]
+        height = fitting[0]
+        candidates = []
+        if self.combined.get(height):
+            f = self._cheapest(self.combined[height], container)
+            candidates.append(self._video_plan(f, None, container))
+        if self.can_merge and self.video_only.get(height) and self.audio_only:
+            video = self._cheapest(self.video_only[height], container)
+            candidates.append(self._video_plan(video, self._mp4_audio(), container))
+        if not candidates:
+            return None
+        # Fewer ffmpeg passes first, then fewer bytes
+        return min(candidates, key=lambda p: (p.remux, p.merge, p.filesize or float('inf')))
+
+    def _video_plan(self, video, audio, container):
+        sizes = [self._size(f) for f in (video, audio) if f is not None]
+        remux = video.get('ext') != container or (audio is not None and audio.get('ext') not in (container, 'm4a'))
+        postprocessors = []
+        if remux and audio is None:
+            postprocessors.append({'key': 'FFmpegVideoRemuxer', 'preferedformat': container})
+        return FormatPlan(
+            video=video, audio=audio, container=container, remux=remux,
+            postprocessors=postprocessors,
+            filesize=sum(sizes) if sizes and None not in sizes else None,
+        )
+
+    def plan_audio(self, codec='mp3', bitrate=192):
+        """Plan an audio download, skipping the re-encode when the source already fits."""
+        # Fall back to extracting from a combined format when there is no audio-only one
+        sources = self.audio_only or sorted(
+            (f for formats in self.combined.values() for f in formats),
+            key=lambda f: self._size(f) or 0)
+        if not sources:
+            return None
+        target_ext = AUDIO_EXTS.get(codec, codec)
+        matching = [f for f in self.audio_only
+                    if f.get('ext') == target_ext and (f.get('abr') or 0) >= bitrate * 0.95]
+        if matching:
+            source = matching[0]
+            transcode = False
+        else:
+            # Smallest source that still carries the requested bitrate
+            enough = [f for f in sources if (f.get('abr') or 0) >= bitrate]
+            source = enough[0] if enough else sources[-1] if self.audio_only else sources[0]
+            transcode = True
+        postprocessors = []
+        if transcode:
+            postprocessors.append({
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': codec,
+                'preferredquality': str(bitrate),
+            })
+        postprocessors.append({'key': 'FFmpegMetadata', 'add_metadata': True})
+        output_size = None
+        if self.duration:
+            output_size = int(bitrate * 1000 / 8 * self.duration) if transcode else self._size(source)
+        return FormatPlan(
+            audio=source, container=target_ext, transcode=transcode,
+            postprocessors=postprocessors, filesize=self._size(source), output_size=output_size,
+            codec=codec, bitrate=bitrate,
+        )
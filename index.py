@@ -1,92 +1,493 @@
 import os
 import sys
-from yt_dlp import YoutubeDL
+import time
+import uuid
+import queue
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
 from yt_dlp.utils import DownloadError
 from tqdm import tqdm
+from metadata_cache import extract_info, download_from_info, downloaded_path
+from progress import PROGRESS_RATE, ProgressAggregator
+from format_planner import FormatIndex
+from transcode import TranscodePipeline
+from range_download import download_format, is_rangeable
+from ydl_pool import get_pool
+from clip import ClipSpec, can_clip
+from metrics import get_metrics, parse_profile
+from bandwidth import get_budget
+from workspace import InsufficientDiskSpace, check_free_space
+from merge import download_and_merge
+from playlist import iter_entries
+from archive import ARCHIVE_PATH, DownloadArchive, format_key
 
-def get_video_info(url):
+# Extracted videos queued per download worker before batch extraction pauses.
+DOWNLOAD_BACKLOG = 2
+
+def get_video_info(url, trace=None):
     """Fetch video info and available formats."""
-    ydl_opts = {'quiet': True, 'skip_download': True}
-    with YoutubeDL(ydl_opts) as ydl:
+    started = time.perf_counter()
+    with get_pool().acquire() as ydl:
         try:
-            info = ydl.extract_info(url, download=False)
+            info = extract_info(ydl, url)
             return info
         except DownloadError as e:
-            print(f"Error: {e}")
+            tqdm.write(f"Error: {e}")
             return None
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            tqdm.write(f"Unexpected error: {e}")
             return None
+        finally:
+            if trace is not None:
+                trace.add('extract', time.perf_counter() - started)
 
-def choose_format(formats, preferred_list):
-    """Choose the best format from preferred resolutions."""
+def choose_format(index, preferred_list):
+    """Plan the first preferred resolution that is available, without re-encoding."""
     for res in preferred_list:
-        for f in formats:
-            if f.get('height') == res and f.get('ext') == 'mp4' and f.get('acodec') != 'none':
-                return f
+        plan = index.plan_video(res, exact=True)
+        if plan:
+            return plan
     return None
 
-def list_available_qualities(formats):
+def list_available_qualities(index):
     """List available video qualities."""
-    qualities = []
-    for f in formats:
-        if f.get('vcodec') != 'none' and f.get('acodec') != 'none' and f.get('ext') == 'mp4':
-            if f.get('height') not in qualities:
-                qualities.append(f.get('height'))
-    return sorted(qualities, reverse=True)
-
-def download_with_progress(url, format_id, output_path):
-    """Download video with progress bar."""
-    class TqdmHook:
-        def __init__(self):
+    return index.heights()
+
+class TqdmHook:
+    """yt-dlp progress hook that drives a throttled tqdm bar and counts finished bytes."""
+    def __init__(self, desc='Downloading', position=None, leave=True, rate=PROGRESS_RATE):
+        self.desc = desc
+        self.position = position
+        self.leave = leave
+        self.pbar = None
+        self.bytes = 0
+        self.progress = ProgressAggregator(self._render, rate=rate)
+    def __call__(self, d):
+        if d['status'] == 'finished':
+            self.bytes += d.get('total_bytes') or d.get('downloaded_bytes') or 0
+        self.progress.hook(d)
+    def _render(self, snapshot):
+        if self.pbar is None:
+            self.pbar = tqdm(total=snapshot['total'], unit='B', unit_scale=True, desc=self.desc,
+                             position=self.position, leave=self.leave)
+        # Video and audio streams are merged, so the total grows when the second one starts
+        if snapshot['total'] > (self.pbar.total or 0):
+            self.pbar.total = snapshot['total']
+        self.pbar.n = snapshot['downloaded']
+        self.pbar.refresh()
+    def close(self, success=True):
+        if self.pbar:
+            self.pbar.n = self.pbar.total
+            self.pbar.close()
             self.pbar = None
-        def __call__(self, d):
-            if d['status'] == 'downloading':
-                if self.pbar is None:
-                    total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
-                    self.pbar = tqdm(total=total, unit='B', unit_scale=True, desc='Downloading')
-                downloaded = d.get('downloaded_bytes', 0)
-                self.pbar.n = downloaded
-                self.pbar.refresh()
-            elif d['status'] == 'finished':
-                if self.pbar:
-                    self.pbar.n = self.pbar.total
-                    self.pbar.close()
-                    print('Download completed!')
+            if success and self.leave:
+                print('Download completed!')
+
+def download_with_progress(url, plan, output_path, info=None, hook=None, postprocess=True, clip=None,
+                           trace=None):
+    """Download a format plan with progress bar, reusing info if already extracted.
+
+    With a clip only that window is fetched; it requires info. A trace
+    records the download, merge and postprocessor phases and the retries.
+    Returns the downloaded file path, or False on failure.
+    """
+    hook = hook or TqdmHook()
+    hook.progress.expected_streams = len(plan.formats)
+    outtmpl = '%(title)s.%(ext)s'
+    if clip is not None:
+        # ffmpeg reads every stream of the window in one run
+        hook.progress.expected_streams = 1
+        outtmpl = f'%(title)s [{clip.label(info)}].%(ext)s'
+    hooks = [hook] if trace is None else [hook, trace.hook]
+
+    def progress_hook(d):
+        for h in hooks:
+            h(d)
+
+    estimate = plan.disk_bytes()
+    if estimate and clip is not None:
+        estimate = int(estimate * clip.fraction(info))
+    if estimate:
+        try:
+            os.makedirs(output_path, exist_ok=True)
+            check_free_space(output_path, estimate, reserve=0)
+        except InsufficientDiskSpace as e:
+            hook.close(success=False)
+            tqdm.write(f"Download failed: {e}")
+            return False
+    fmt = plan.formats[0]
+    # Fragment concurrency, buffer size and rate limit follow measured throughput
+    controller = get_budget().controller(fmt.get('url'))
     ydl_opts = {
-        'format': format_id,
-        'outtmpl': os.path.join(output_path, '%(title)s.%(ext)s'),
-        'progress_hooks': [TqdmHook()],
+        'outtmpl': os.path.join(output_path, outtmpl),
+        'progress_hooks': hooks + [controller.hook],
         'quiet': True,
+        'noprogress': True,
         'noplaylist': True,
         'merge_output_format': 'mp4',
+        **controller.ydl_opts(bool(fmt.get('fragments'))),
+        **plan.ydl_opts(postprocess=postprocess),
     }
-    with YoutubeDL(ydl_opts) as ydl:
+    if clip is not None:
+        ydl_opts.update(clip.ydl_opts(info))
+    if trace is not None:
+        ydl_opts.update(postprocessor_hooks=[trace.postprocessor_hook], logger=trace.logger)
+    # A single progressive file with nothing to postprocess is fetched as parallel byte ranges
+    accelerate = (info is not None and clip is None and not plan.merge and is_rangeable(fmt, ydl_opts)
+                  and not (postprocess and plan.postprocessors))
+    with controller, get_pool().acquire(ydl_opts) as ydl:
+        controller.attach(ydl.params)
         try:
-            ydl.download([url])
+            if accelerate:
+                filename = download_format(ydl, info, fmt, progress_hook=progress_hook)
+                hook.close()
+                return filename
+            if plan.merge and info is not None and clip is None:
+                # Both streams at once, then a single stream-copy merge
+                filename = download_and_merge(ydl, info, plan, progress_hook=progress_hook,
+                                              postprocessor_hook=trace and trace.postprocessor_hook)
+                hook.close()
+                return filename
+            if info is not None:
+                result = download_from_info(ydl, info)
+            else:
+                result = ydl.extract_info(url, download=True)
+            filename = downloaded_path(ydl, result)
         except Exception as e:
-            print(f"Download failed: {e}")
+            hook.close(success=False)
+            tqdm.write(f"Download failed: {e}")
             return False
+    hook.close()
+    return filename
+
+def pick_format(info, quality=None, audio_bitrate=None):
+    """Pick a format plan without prompting, using the same rules as the interactive menu."""
+    index = FormatIndex.from_info(info)
+    if audio_bitrate:
+        return index.plan_audio('mp3', audio_bitrate)
+    qualities = list_available_qualities(index)
+    if not qualities:
+        return None
+    preferred = [quality] if quality else [1080, 720, 360]
+    return choose_format(index, preferred) or choose_format(index, qualities)
+
+def read_urls(source):
+    """Read URLs from a file path or '-' for stdin, skipping blanks and # comments."""
+    stream = sys.stdin if source == '-' else open(source, encoding='utf-8')
+    try:
+        return [line.strip() for line in stream if line.strip() and not line.lstrip().startswith('#')]
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def run_batch(urls, output_path, quality=None, extract_workers=8, download_workers=3, audio_bitrate=None,
+              on_success=None):
+    """Extract and download many URLs with two bounded thread pools.
+
+    With audio_bitrate set, finished audio goes to a TranscodePipeline so the
+    next download starts while earlier files are still encoding.
+    on_success(url) is called for every URL that was saved completely.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    pipeline = TranscodePipeline() if audio_bitrate else None
+    metrics = get_metrics()
+    start = time.time()
+    failures = []
+    total_bytes = 0
+    succeeded = 0
+    # Each concurrent download gets its own tqdm line under the aggregate bar
+    positions = queue.Queue()
+    for i in range(download_workers):
+        positions.put(i + 1)
+
+    def extract(url):
+        # Every URL is traced from extraction to its final outcome
+        trace = metrics.trace(uuid.uuid4().hex, 'cli', url)
+        return get_video_info(url, trace), trace
+
+    def download(url, info, plan, trace):
+        position = positions.get()
+        hook = TqdmHook(desc=(info.title or url)[:30], position=position, leave=False)
+        trace.label = info.title or url
+        started = time.time()
+        try:
+            path = download_with_progress(url, plan, output_path, info=info, hook=hook,
+                                          postprocess=pipeline is None, trace=trace)
+        finally:
+            positions.put(position)
+        if path and pipeline:
+            return pipeline.submit(path, plan, info, time.time() - started), hook.bytes
+        return path, hook.bytes
+
+    # urls may be a lazy playlist listing; the total grows as it is consumed
+    known = hasattr(urls, '__len__')
+    overall = tqdm(total=len(urls) if known else None, unit='video', desc='Batch', position=0)
+    pending_urls = iter(urls)
+    listed = 0
+    encoding = {}
+
+    def downloaded(future, url, trace):
+        nonlocal total_bytes, succeeded
+        try:
+            outcome, size = future.result()
+        except Exception:
+            outcome, size = False, 0
+        if not outcome:
+            failures.append((url, 'download failed'))
+            trace.finish('download failed')
+            overall.update(1)
+        elif pipeline:
+            # outcome is the encoder's future; the item counts once it is encoded
+            total_bytes += size
+            encoding[outcome] = url, trace
+        else:
+            trace.finish()
+            succeeded += 1
+            total_bytes += size
+            overall.update(1)
+            if on_success:
+                on_success(url)
+
+    with ThreadPoolExecutor(extract_workers) as extractors, ThreadPoolExecutor(download_workers) as downloaders:
+        extracting = {}
+        downloading = {}
+        while True:
+            # Keep the extract pool busy without listing everything up front, and
+            # stop while downloads are backed up: held info costs memory and its
+            # signed stream URLs expire while waiting
+            while (pending_urls is not None and len(extracting) < extract_workers * 2
+                   and len(downloading) < download_workers * DOWNLOAD_BACKLOG):
+                url = next(pending_urls, None)
+                if url is None:
+                    pending_urls = None
+                    break
+                extracting[extractors.submit(extract, url)] = url
+                listed += 1
+                if not known:
+                    overall.total = listed
+                    overall.refresh()
+            if not extracting and not downloading:
+                break
+            finished, _ = wait(set(extracting) | set(downloading), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in downloading:
+                    downloaded(future, *downloading.pop(future))
+                    continue
+                url = extracting.pop(future)
+                info, trace = future.result()
+                plan = pick_format(info, quality, audio_bitrate) if info else None
+                if plan is None:
+                    failures.append((url, 'no info' if not info else 'no suitable format'))
+                    trace.finish(failures[-1][1])
+                    overall.update(1)
+                    continue
+                downloading[downloaders.submit(download, url, info, plan, trace)] = url, trace
+        for future in as_completed(encoding):
+            url, trace = encoding[future]
+            try:
+                timing = future.result()
+                trace.add_wait('transcode', timing['queue_wait'])
+                trace.add('transcode', timing['encode'])
+                trace.finish()
+                succeeded += 1
+                if on_success:
+                    on_success(url)
+            except Exception as e:
+                failures.append((url, str(e)))
+                trace.finish(e)
+            overall.update(1)
+    overall.close()
+
+    elapsed = time.time() - start
+    print(f"\nBatch finished in {elapsed:.1f}s: {succeeded} downloaded, {len(failures)} failed")
+    print(f"Throughput: {total_bytes / (1024 * 1024) / max(elapsed, 1e-9):.2f} MB/s, "
+          f"{succeeded * 60 / max(elapsed, 1e-9):.1f} videos/min")
+    if pipeline:
+        summary = pipeline.summary()
+        pipeline.close()
+        print("Stage timings (total / mean per file): " + ", ".join(
+            f"{stage} {summary[stage]['total']:.1f}s / {summary[stage]['mean']:.1f}s"
+            for stage in ('download', 'queue_wait', 'encode')))
+    for url, reason in failures:
+        print(f"  FAILED {url}: {reason}")
+    return not failures
+
+def run_sync(sources, output_path, archive, quality=None, audio_bitrate=None, stop_after=20,
+             extract_workers=8, download_workers=3):
+    """Download what is new in each channel or playlist, using the archive to skip the rest.
+
+    Entries are checked against the archive from their flat listing, before
+    any per-video extraction. Listing stops once stop_after archived entries
+    in a row have been seen (0 lists everything), since newer uploads come first.
+    """
+    fmt = format_key(quality, audio_bitrate)
+    ok = True
+    for source in sources:
+        counts = {'listed': 0, 'skipped': 0, 'new': 0}
+        stopped_early = False
+        pending = {}
+
+        def fresh_urls():
+            nonlocal stopped_early
+            run = 0
+            for entry in iter_entries(source):
+                counts['listed'] += 1
+                if entry['id'] and archive.contains(entry['extractor'], entry['id'], fmt):
+                    counts['skipped'] += 1
+                    run += 1
+                    if stop_after and run >= stop_after:
+                        # Closing the generator stops paging through the source
+                        stopped_early = True
+                        return
+                    continue
+                run = 0
+                pending[entry['url']] = entry
+                yield entry['url']
+
+        def archived(url):
+            entry = pending[url]
+            if entry['id']:
+                archive.add(entry['extractor'], entry['id'], fmt, entry['title'])
+            counts['new'] += 1
+
+        print(f"\nSyncing {source}")
+        try:
+            ok = run_batch(fresh_urls(), output_path, quality, extract_workers, download_workers,
+                           audio_bitrate, on_success=archived) and ok
+        except Exception as e:
+            tqdm.write(f"Listing failed: {e}")
+            ok = False
+        failed = len(pending) - counts['new']
+        note = f", stopped after {stop_after} archived entries in a row" if stopped_early else ""
+        print(f"Sync of {source}: {counts['new']} new, {counts['skipped']} skipped, {failed} failed "
+              f"({counts['listed']} listed{note})")
+    return ok
+
+def download_audio(url, info, bitrate, output_path, clip=None, trace=None):
+    """Download the audio of one video and encode it to MP3 in a single ffmpeg pass."""
+    plan = FormatIndex.from_info(info).plan_audio('mp3', bitrate)
+    if not plan:
+        print("No audio format found.")
+        return False
+    print(f"\nDownloading: {info.title} [{plan.describe()}]")
+    pipeline = TranscodePipeline(workers=1)
+    started = time.time()
+    try:
+        path = download_with_progress(url, plan, output_path, info=info, postprocess=False, clip=clip,
+                                      trace=trace)
+        if not path:
+            return False
+        timing = pipeline.submit(path, plan, info, time.time() - started).result()
+        if trace is not None:
+            trace.add_wait('transcode', timing['queue_wait'])
+            trace.add('transcode', timing['encode'])
+    except Exception as e:
+        print(f"Encoding failed: {e}")
+        return False
+    finally:
+        pipeline.close()
+    print(f"Saved to: {timing['output']} (download {timing['download']:.1f}s, encode {timing['encode']:.1f}s)")
     return True
 
 def main():
+    parser = argparse.ArgumentParser(description="YouTube Video Downloader (yt-dlp)")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="download every URL in FILE ('-' for stdin) without prompting")
+    parser.add_argument('--playlist', metavar='URL',
+                        help="download every entry of a playlist without prompting")
+    parser.add_argument('--sync', metavar='URL', nargs='+',
+                        help="download only entries of these channels/playlists that are not in the archive")
+    parser.add_argument('--archive', metavar='FILE',
+                        help="SQLite archive used by --sync (default: YTD_ARCHIVE or OUTPUT/archive.sqlite3)")
+    parser.add_argument('--stop-after', type=int, default=20, metavar='N',
+                        help="stop listing a source after N archived entries in a row (0: never)")
+    parser.add_argument('--quality', type=int, metavar='HEIGHT',
+                        help="preferred height for batch and playlist mode (default: 1080 > 720 > 360)")
+    parser.add_argument('--mp3', type=int, metavar='KBPS',
+                        help="download audio only and encode it to MP3 at this bitrate")
+    parser.add_argument('--start', metavar='TIME',
+                        help="download only from TIME (seconds, MM:SS or HH:MM:SS)")
+    parser.add_argument('--end', metavar='TIME',
+                        help="download only up to TIME (seconds, MM:SS or HH:MM:SS)")
+    parser.add_argument('--chapter', metavar='NAME',
+                        help="download only the first chapter whose title contains NAME")
+    parser.add_argument('--precise', action='store_true',
+                        help="re-encode clips to cut exactly at --start/--end instead of at keyframes")
+    parser.add_argument('--metrics-log', metavar='FILE',
+                        help="append one JSON line with phase timings per video to FILE (default: YTD_METRICS_LOG)")
+    parser.add_argument('--profile', metavar='KINDS',
+                        help="profile the download: 'cpu', 'memory' or 'cpu,memory' (written to YTD_PROFILE_DIR)")
+    parser.add_argument('--extract-workers', type=int, default=8)
+    parser.add_argument('--download-workers', type=int, default=3)
+    parser.add_argument('--output', default=os.path.join(os.getcwd(), 'downloads'))
+    args = parser.parse_args()
+    try:
+        clip = ClipSpec.parse(args.start, args.end, args.chapter, args.precise)
+    except ValueError as e:
+        parser.error(str(e))
+    if clip is not None and (args.sync or args.batch or args.playlist):
+        parser.error("--start, --end and --chapter only apply to a single video")
+    if clip is not None and not can_clip():
+        parser.error("downloading part of a video needs ffmpeg")
+    if args.profile and (args.sync or args.batch or args.playlist):
+        parser.error("--profile only applies to a single video")
+    if args.metrics_log:
+        get_metrics().log_path = args.metrics_log
+    if args.sync:
+        archive = DownloadArchive(args.archive or ARCHIVE_PATH or os.path.join(args.output, 'archive.sqlite3'))
+        try:
+            ok = run_sync(args.sync, args.output, archive, args.quality, args.mp3, args.stop_after,
+                          args.extract_workers, args.download_workers)
+        finally:
+            archive.close()
+        sys.exit(0 if ok else 1)
+    if args.batch or args.playlist:
+        if args.playlist:
+            # Entries are listed page by page while the first ones already download
+            urls = (entry['url'] for entry in iter_entries(args.playlist))
+        else:
+            urls = read_urls(args.batch)
+        ok = run_batch(urls, args.output, args.quality, args.extract_workers, args.download_workers, args.mp3)
+        sys.exit(0 if ok else 1)
+
     print("YouTube Video Downloader (yt-dlp)")
+    # Load yt-dlp while the user is still typing the URL
+    get_pool().warm()
     url = input("Enter YouTube video URL: ").strip()
     if not url:
         print("No URL entered. Exiting.")
         sys.exit(1)
-    info = get_video_info(url)
-    if not info:
-        print("Failed to retrieve video info. Exiting.")
-        sys.exit(1)
-    formats = info.get('formats', [])
-    if not formats:
-        print("No downloadable formats found.")
+    # cProfile only sees the thread that enables it, which is this one here
+    trace = get_metrics().trace(uuid.uuid4().hex, 'cli', url, parse_profile(args.profile))
+
+    def fail(message):
+        print(message)
+        trace.finish(message)
         sys.exit(1)
-    qualities = list_available_qualities(formats)
+
+    info = get_video_info(url, trace)
+    if not info:
+        fail("Failed to retrieve video info. Exiting.")
+    trace.label = info.title or url
+    if not info.formats:
+        fail("No downloadable formats found.")
+    if clip is not None:
+        try:
+            print(f"Clip: {clip.label(info)}" + (" (re-encoded for exact cuts)" if clip.precise else ""))
+        except ValueError as e:
+            fail(str(e))
+    downloads_dir = args.output
+    os.makedirs(downloads_dir, exist_ok=True)
+    if args.mp3:
+        if not download_audio(url, info, args.mp3, downloads_dir, clip, trace):
+            fail("Download failed.")
+        trace.finish()
+        print(f"Phases: {trace.summary()}")
+        sys.exit(0)
+    index = FormatIndex.from_info(info)
+    qualities = list_available_qualities(index)
     if not qualities:
-        print("No suitable video qualities found.")
-        sys.exit(1)
+        fail("No suitable video qualities found.")
     print("\nAvailable qualities:")
     for i, q in enumerate(qualities):
         print(f"  {i+1}. {q}p")
@@ -97,25 +498,25 @@ def main():
         choice = 0
     preferred = [1080, 720, 360]
     if choice == 0:
-        fmt = choose_format(formats, preferred)
+        plan = choose_format(index, preferred)
     elif 1 <= choice <= len(qualities):
-        fmt = choose_format(formats, [qualities[choice-1]])
+        plan = choose_format(index, [qualities[choice-1]])
     else:
         print("Invalid choice. Using default.")
-        fmt = choose_format(formats, preferred)
-    if not fmt:
+        plan = choose_format(index, preferred)
+    if not plan:
         print("Requested quality not available. Trying best available...")
-        fmt = choose_format(formats, qualities)
-    if not fmt:
-        print("No suitable format found. Exiting.")
-        sys.exit(1)
-    format_id = fmt['format_id']
-    downloads_dir = os.path.join(os.getcwd(), 'downloads')
-    os.makedirs(downloads_dir, exist_ok=True)
-    print(f"\nDownloading: {info.get('title')} [{fmt.get('height')}p]")
-    success = download_with_progress(url, format_id, downloads_dir)
+        plan = choose_format(index, qualities)
+    if not plan:
+        fail("No suitable format found. Exiting.")
+    filesize = plan.filesize * clip.fraction(info) if plan.filesize and clip else plan.filesize
+    size = f", ~{filesize / (1024 * 1024):.1f}MB" if filesize else ""
+    print(f"\nDownloading: {info.title} [{plan.height}p, {plan.describe()}{size}]")
+    success = download_with_progress(url, plan, downloads_dir, info=info, clip=clip, trace=trace)
+    trace.finish(None if success else "Download failed.")
     if success:
         print(f"\nSaved to: {downloads_dir}")
+        print(f"Phases: {trace.summary()}")
     else:
         print("Download failed.")
 
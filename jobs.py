@@ -0,0 +1,170 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import get_metrics
+
+MAX_WORKERS = int(os.environ.get('YTD_MAX_JOBS', 8))
+NETWORK_SLOTS = int(os.environ.get('YTD_NETWORK_SLOTS', 4))
+CPU_SLOTS = int(os.environ.get('YTD_CPU_SLOTS', os.cpu_count() or 2))
+# Finished jobs stay reachable this long so a refreshed page can pick up the result.
+JOB_RETENTION = int(os.environ.get('YTD_JOB_RETENTION', 3600))
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class Job:
+    """State of one scheduled unit of work, shared by every session waiting on it."""
+
+    def __init__(self, key, scheduler):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = QUEUED
+        self.stage = None
+        self.progress = {}
+        self.info = None
+        self.trace = None
+        self.result = None
+        self.error = None
+        self.subscribers = 1
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._scheduler = scheduler
+        self._slot = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def update(self, **progress):
+        """Merge progress fields; called from the worker thread."""
+        self.progress = {**self.progress, **progress}
+
+    def enter(self, stage):
+        """Move the job into the 'network' or 'cpu' stage, waiting for a free slot."""
+        if stage == self.stage:
+            return
+        self._release_slot()
+        slot = self._scheduler.slots.get(stage)
+        self.stage = stage
+        if slot is not None:
+            started = time.perf_counter()
+            slot.acquire()
+            self._slot = slot
+            if self.trace is not None:
+                self.trace.add_wait(stage, time.perf_counter() - started)
+
+    def _release_slot(self):
+        if self._slot is not None:
+            self._slot.release()
+            self._slot = None
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class JobScheduler:
+    """Bounded worker pool that coalesces identical concurrent jobs.
+
+    Jobs submitted under a key that is already queued or running attach to
+    the existing job instead of starting a second one. Network and CPU heavy
+    stages are additionally limited by their own slot counts.
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS, network_slots=NETWORK_SLOTS,
+                 cpu_slots=CPU_SLOTS, retention=JOB_RETENTION):
+        self.retention = retention
+        self.slots = {
+            'network': threading.BoundedSemaphore(network_slots),
+            'cpu': threading.BoundedSemaphore(cpu_slots),
+        }
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def _claim(self, key):
+        # Returns the job for key and whether the caller has to run it
+        with self._lock:
+            self._prune()
+            job = self._active.get(key)
+            if job is not None:
+                job.subscribers += 1
+                return job, False
+            job = Job(key, self)
+            self._jobs[job.id] = job
+            self._active[key] = job
+            return job, True
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Run fn(job, *args, **kwargs) in the pool, or join the running job for key."""
+        job, new = self._claim(key)
+        if new:
+            self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def run(self, key, fn, *args, **kwargs):
+        """Run fn(job, ...) in the calling thread, or wait for the job already running for key.
+
+        For work that already owns a thread, such as the entries of a
+        playlist job; the network and CPU slots still apply.
+        """
+        job, new = self._claim(key)
+        if new:
+            self._run(job, fn, args, kwargs)
+        else:
+            job.wait()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        job.started = time.time()
+        # Traced per job: phases are added by fn, slot waits by enter()
+        job.trace = get_metrics().trace(job.id, 'job')
+        job.trace.add_wait('worker', job.started - job.created)
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.status = DONE
+        except Exception as e:
+            job.error = e
+            job.status = FAILED
+        finally:
+            job.trace.finish(job.error)
+            job._release_slot()
+            job.stage = None
+            job.finished = time.time()
+            with self._lock:
+                if self._active.get(job.key) is job:
+                    del self._active[job.key]
+            job._done.set()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [i for i, j in self._jobs.items() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {status: sum(1 for j in jobs if j.status == status)
+                for status in (QUEUED, RUNNING, DONE, FAILED)}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide job scheduler."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
@@ -0,0 +1,68 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from range_download import download_format, is_rangeable
+
+# Containers whose index can be moved to the front by the muxer itself.
+FASTSTART_CONTAINERS = ('mp4', 'm4a', 'mov')
+
+
+def merge_command(video_path, audio_path, dst, container):
+    """One ffmpeg pass that stream-copies video and audio into dst."""
+    cmd = [shutil.which('ffmpeg') or 'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+           '-i', video_path, '-i', audio_path, '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy']
+    if container in FASTSTART_CONTAINERS:
+        # The muxer rewrites the index at the end of this same run, no second pass
+        cmd += ['-movflags', '+faststart']
+    return cmd + [dst]
+
+
+def _component_path(output, fmt):
+    # Same naming as yt-dlp's own intermediate files
+    return f"{os.path.splitext(output)[0]}.f{fmt['format_id']}.{fmt.get('ext') or 'part'}"
+
+
+def _fetch(ydl, info, fmt, path, progress_hook):
+    if is_rangeable(fmt, ydl.params):
+        return download_format(ydl, info, fmt, progress_hook=progress_hook, filename=path)
+    # Fragmented (DASH/HLS) streams go through yt-dlp's downloader, which
+    # reports through the progress hooks of ydl
+    if not ydl.dl(path, dict(info.fields(), **fmt)):
+        raise RuntimeError(f"Download of format {fmt['format_id']} failed")
+    return path
+
+
+def download_and_merge(ydl, info, plan, progress_hook=None, postprocessor_hook=None):
+    """Fetch the video and audio of a merge plan at the same time, then merge once.
+
+    Returns the path of the merged file, named like yt-dlp would name it.
+    postprocessor_hook gets yt-dlp style started/finished events around the
+    merge so callers can show it as a conversion step.
+    """
+    output = ydl.prepare_filename(dict(info.fields(), ext=plan.container))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    paths = [_component_path(output, fmt) for fmt in (plan.video, plan.audio)]
+    try:
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='component') as pool:
+            futures = [pool.submit(_fetch, ydl, info, fmt, path, progress_hook)
+                       for fmt, path in zip((plan.video, plan.audio), paths)]
+            for future in futures:
+                future.result()
+        if postprocessor_hook:
+            postprocessor_hook({'status': 'started', 'postprocessor': 'Merger', 'info_dict': info.fields()})
+        tmp = f'{os.path.splitext(output)[0]}.temp.{plan.container}'
+        result = subprocess.run(merge_command(paths[0], paths[1], tmp, plan.container),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        os.replace(tmp, output)
+        if postprocessor_hook:
+            postprocessor_hook({'status': 'finished', 'postprocessor': 'Merger', 'info_dict': info.fields()})
+    finally:
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return output
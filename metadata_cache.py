@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from ydl_pool import get_pool
+from video_info import VideoInfo
+
+CACHE_DIR = os.environ.get('YTD_METADATA_CACHE', os.path.join('.cache', 'metadata'))
+# Stream URLs inside an info dict expire after a few hours, keep well below that.
+DEFAULT_TTL = int(os.environ.get('YTD_METADATA_TTL', 1800))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('YTD_METADATA_ENTRIES', 64))
+DEFAULT_MAX_DISK_ENTRIES = int(os.environ.get('YTD_METADATA_DISK_ENTRIES', 1024))
+# Bumped when the stored record changes; older files are treated as misses.
+RECORD_VERSION = 4
+
+_YOUTUBE_ID_RE = re.compile(
+    r'(?:youtube(?:-nocookie)?\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)|youtu\.be/)'
+    r'([0-9A-Za-z_-]{11})')
+
+
+def canonical_id(url):
+    """Return a stable cache key for a video URL."""
+    url = url.strip()
+    match = _YOUTUBE_ID_RE.search(url)
+    if match:
+        return f'youtube:{match.group(1)}'
+    return 'url:' + hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+class MetadataCache:
+    """In-memory LRU of VideoInfo records with TTL, backed by one JSON file per entry."""
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=DEFAULT_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES, max_disk_entries=DEFAULT_MAX_DISK_ENTRIES):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, key):
+        """Return the cached VideoInfo for key, or None if missing or expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                del self._entries[key]
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (record.get('key') != key or record.get('version') != RECORD_VERSION
+                or now - record.get('stored_at', 0) >= self.ttl):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        info = VideoInfo.from_json(record['info'])
+        self._remember(key, record['stored_at'], info)
+        return info
+
+    def put(self, key, info):
+        """Store a VideoInfo under key."""
+        stored_at = time.time()
+        self._remember(key, stored_at, info)
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'key': key, 'version': RECORD_VERSION, 'stored_at': stored_at,
+                           'info': info.to_json()}, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._prune_disk()
+
+    def _remember(self, key, stored_at, info):
+        with self._lock:
+            self._entries[key] = (stored_at, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune_disk(self):
+        try:
+            names = [n for n in os.listdir(self.cache_dir) if n.endswith('.json')]
+        except OSError:
+            return
+        if len(names) <= self.max_disk_entries:
+            return
+        paths = [os.path.join(self.cache_dir, n) for n in names]
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:len(paths) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide metadata cache shared by both frontends."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MetadataCache()
+        return _cache
+
+
+def extract_info(ydl, url):
+    """Extract a VideoInfo for url without downloading, reusing a cached one if fresh."""
+    cache = get_cache()
+    key = canonical_id(url)
+    info = cache.get(key)
+    if info is None:
+        info = VideoInfo.from_info(ydl.sanitize_info(ydl.extract_info(url, download=False)))
+        cache.put(key, info)
+    return info
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def fetch_info(url, ydl_opts=None):
+    """Extract info for url with a pooled YoutubeDL, going through the cache.
+
+    Concurrent calls for the same video share one extraction, so a job
+    started while a prefetch is still running waits for it instead of
+    extracting again.
+    """
+    key = canonical_id(url)
+    # Streamlit calls this on every rerun; a hit must not touch yt-dlp at all
+    info = get_cache().get(key)
+    if info is not None:
+        return info
+    with _inflight_lock:
+        pending = _inflight.get(key)
+        owner = pending is None
+        if owner:
+            pending = _inflight[key] = Future()
+    if not owner:
+        return pending.result()
+    try:
+        with get_pool().acquire(dict(ydl_opts, skip_download=True) if ydl_opts else None) as ydl:
+            info = extract_info(ydl, url)
+        pending.set_result(info)
+        return info
+    except BaseException as e:
+        pending.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+
+def download_from_info(ydl, info):
+    """Download using a previously extracted VideoInfo instead of extracting again."""
+    # Same path yt-dlp takes for --load-info-json: drop the previous format
+    # selection so the options of this YoutubeDL instance are applied.
+    clean = ydl.sanitize_info(info.to_info(), remove_private_keys=True)
+    return ydl.process_ie_result(clean, download=True)
+
+
+def downloaded_path(ydl, result):
+    """Path of the finished file of a download, as yt-dlp reports it after its postprocessors."""
+    for download in result.get('requested_downloads') or ():
+        if download.get('filepath'):
+            return download['filepath']
+    return result.get('filepath') or ydl.prepare_filename(result)
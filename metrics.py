@@ -0,0 +1,352 @@
+import os
+import re
+import json
+import time
+import cProfile
+import threading
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+# One JSON object per finished job is appended here when set.
+METRICS_LOG = os.environ.get('YTD_METRICS_LOG')
+# Profilers to run for every job: 'cpu', 'memory' or 'cpu,memory'.
+PROFILE = os.environ.get('YTD_PROFILE', '')
+PROFILE_DIR = os.environ.get('YTD_PROFILE_DIR', os.path.join('.cache', 'profiles'))
+PROFILE_TOP = 30
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+# yt-dlp reports retries as 'Retrying (2/10)...' or 'Retrying fragment 7 (2/10)...'
+_RETRY_RE = re.compile(r'Retrying(?: (fragments?))?\b[^(]*\((\d+)/\d+\)')
+
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, None where unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def parse_profile(value):
+    """Profiler names from 'cpu,memory' style input."""
+    return tuple(p for p in (s.strip() for s in (value or '').split(',')) if p in ('cpu', 'memory'))
+
+
+class _Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in labels.items()) + '}'
+
+
+class _RetryLogger:
+    """yt-dlp logger that counts retry messages and otherwise stays quiet."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def debug(self, msg):
+        match = _RETRY_RE.search(msg)
+        if match:
+            self.trace.count_retry('fragment' if match.group(1) else 'http')
+
+    warning = debug
+
+    def error(self, msg):
+        pass
+
+
+class JobTrace:
+    """Phase timings, bytes, retries and queue waits of one job.
+
+    Phases are recorded as they end, so one phase can occur several times
+    (one 'download' per stream). The trace also serves as yt-dlp progress
+    and postprocessor hook and, through ``logger``, counts the retries
+    yt-dlp makes within its retries/fragment_retries budget. finish() hands
+    the record to Metrics, which aggregates it and writes the JSON line.
+    """
+
+    def __init__(self, metrics, job_id, source, label=None, profile=()):
+        self.metrics = metrics
+        self.job_id = job_id
+        self.source = source
+        self.label = label
+        self.phases = []
+        self.retries = {'http': 0, 'fragment': 0}
+        self.queue_wait = defaultdict(float)
+        self.logger = _RetryLogger(self)
+        self.started = time.time()
+        self.record = None
+        self._streams = {}
+        self._postprocessors = {}
+        self._profilers = {}
+        self._lock = threading.Lock()
+        self.start_profile(profile)
+
+    @contextmanager
+    def phase(self, name, **fields):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started, **fields)
+
+    def add(self, name, seconds, **fields):
+        """Record a phase measured elsewhere, e.g. by the transcoding pipeline."""
+        with self._lock:
+            self.phases.append({'phase': name, 'seconds': round(seconds, 4), **fields})
+
+    @contextmanager
+    def waiting(self, queue):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_wait(queue, time.perf_counter() - started)
+
+    def add_wait(self, queue, seconds):
+        with self._lock:
+            self.queue_wait[queue] += seconds
+
+    def count_retry(self, kind, count=1):
+        with self._lock:
+            self.retries[kind] += count
+
+    def hook(self, d):
+        """yt-dlp progress hook; one 'download' phase per finished stream."""
+        key = d.get('filename') or d.get('tmpfilename')
+        with self._lock:
+            first_seen = self._streams.setdefault(key, time.perf_counter())
+        if d['status'] != 'finished':
+            return
+        seconds = d.get('elapsed') or time.perf_counter() - first_seen
+        fields = {'bytes': d.get('total_bytes') or d.get('downloaded_bytes') or 0}
+        format_id = (d.get('info_dict') or {}).get('format_id')
+        if format_id:
+            fields['format'] = format_id
+        if d.get('retries'):
+            # RangeDownloader counts its own per-piece retries
+            self.count_retry('http', d['retries'])
+        self.add('download', seconds, **fields)
+
+    def postprocessor_hook(self, d):
+        """yt-dlp postprocessor hook; the merge and every other postprocessor get a phase."""
+        name = d.get('postprocessor') or 'postprocess'
+        if d['status'] == 'started':
+            with self._lock:
+                self._postprocessors[name] = time.perf_counter()
+        elif d['status'] == 'finished':
+            with self._lock:
+                started = self._postprocessors.pop(name, None)
+            if started is not None:
+                self.add('merge' if name == 'Merger' else f'postprocess.{name}', time.perf_counter() - started)
+
+    def start_profile(self, kinds):
+        """Profile the rest of this job: 'cpu' (cProfile, this thread) and/or 'memory' (tracemalloc)."""
+        global _tracemalloc_users
+        if 'cpu' in kinds and 'cpu' not in self._profilers:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._profilers['cpu'] = profiler
+            except ValueError:
+                # Another profiler is already active (Python 3.12+ allows one at a time)
+                pass
+        if 'memory' in kinds and 'memory' not in self._profilers:
+            # tracemalloc is process-wide; concurrent jobs show up in each other's captures
+            with _tracemalloc_lock:
+                if not _tracemalloc_users:
+                    tracemalloc.start()
+                _tracemalloc_users += 1
+            tracemalloc.reset_peak()
+            self._profilers['memory'] = tracemalloc.take_snapshot()
+
+    def _stop_profile(self):
+        global _tracemalloc_users
+        paths = []
+        if not self._profilers:
+            return paths
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler = self._profilers.pop('cpu', None)
+        if profiler is not None:
+            profiler.disable()
+            path = os.path.join(PROFILE_DIR, f'{self.job_id}.prof')
+            profiler.dump_stats(path)
+            paths.append(path)
+        before = self._profilers.pop('memory', None)
+        if before is not None:
+            after = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            with _tracemalloc_lock:
+                _tracemalloc_users -= 1
+                if not _tracemalloc_users:
+                    tracemalloc.stop()
+            path = os.path.join(PROFILE_DIR, f'{self.job_id}.tracemalloc.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f'peak traced: {peak} bytes\n')
+                for stat in after.compare_to(before, 'lineno')[:PROFILE_TOP]:
+                    f.write(f'{stat}\n')
+            paths.append(path)
+        return paths
+
+    def finish(self, error=None):
+        """Close the trace once; returns the record that was logged."""
+        with self._lock:
+            if self.record is not None:
+                return self.record
+            self.record = {}
+        record = {
+            'time': round(self.started, 3),
+            'job': self.job_id,
+            'source': self.source,
+            'label': self.label,
+            'status': 'failed' if error else 'ok',
+            'error': str(error) if error else None,
+            'wall': round(time.time() - self.started, 4),
+            'phases': list(self.phases),
+            'bytes': sum(p.get('bytes', 0) for p in self.phases),
+            'retries': dict(self.retries),
+            'queue_wait': {k: round(v, 4) for k, v in self.queue_wait.items()},
+            'peak_rss': peak_rss(),
+        }
+        profiles = self._stop_profile()
+        if profiles:
+            record['profiles'] = profiles
+        self.record = record
+        self.metrics.record(record)
+        return record
+
+    def summary(self):
+        """Phase totals in one line, e.g. 'extract 0.4s, download 3.1s (24.0MiB), merge 0.6s'."""
+        totals = {}
+        with self._lock:
+            for p in self.phases:
+                seconds, nbytes = totals.get(p['phase'], (0.0, 0))
+                totals[p['phase']] = (seconds + p['seconds'], nbytes + p.get('bytes', 0))
+        parts = []
+        for name, (seconds, nbytes) in totals.items():
+            size = f' ({nbytes / (1024 * 1024):.1f}MiB)' if nbytes else ''
+            parts.append(f'{name} {seconds:.1f}s{size}')
+        return ', '.join(parts)
+
+
+class Metrics:
+    """Process-wide aggregate of finished job traces.
+
+    render() produces the Prometheus text format served on the sidecar's
+    /metrics route; every finished job is also appended to log_path as
+    one JSON line when set.
+    """
+
+    def __init__(self, log_path=METRICS_LOG, profile=PROFILE):
+        self.log_path = log_path
+        self.profile = parse_profile(profile)
+        self._phases = defaultdict(_Histogram)
+        self._phase_bytes = defaultdict(int)
+        self._queue_wait = defaultdict(_Histogram)
+        self._retries = defaultdict(int)
+        self._jobs = defaultdict(int)
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def trace(self, job_id, source, label=None, profile=()):
+        return JobTrace(self, job_id, source, label, self.profile + tuple(profile or ()))
+
+    def gauge(self, name, help_text, fn):
+        """Report fn() at scrape time; fn returns a number or a {label value: number} dict."""
+        with self._lock:
+            self._gauges[name] = (help_text, fn)
+
+    def record(self, record):
+        with self._lock:
+            for p in record['phases']:
+                self._phases[p['phase']].observe(p['seconds'])
+                self._phase_bytes[p['phase']] += p.get('bytes', 0)
+            for queue, seconds in record['queue_wait'].items():
+                self._queue_wait[queue].observe(seconds)
+            for kind, count in record['retries'].items():
+                self._retries[kind] += count
+            self._jobs[(record['source'], record['status'])] += 1
+            if self.log_path:
+                try:
+                    with open(self.log_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record) + '\n')
+                except OSError:
+                    pass
+
+    def _histogram(self, lines, name, help_text, label, histograms):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for value, h in sorted(histograms.items()):
+            for bound, count in zip(BUCKETS, h.counts):
+                lines.append(f'{name}_bucket{_labels(**{label: value, "le": bound})} {count}')
+            lines.append(f'{name}_bucket{_labels(**{label: value, "le": "+Inf"})} {h.count}')
+            lines.append(f'{name}_sum{_labels(**{label: value})} {h.total:.6f}')
+            lines.append(f'{name}_count{_labels(**{label: value})} {h.count}')
+
+    def render(self):
+        lines = []
+        with self._lock:
+            self._histogram(lines, 'ytd_phase_seconds', 'Duration of job phases.', 'phase', self._phases)
+            lines += ['# HELP ytd_phase_bytes_total Bytes moved per job phase.',
+                      '# TYPE ytd_phase_bytes_total counter']
+            lines += [f'ytd_phase_bytes_total{_labels(phase=k)} {v}' for k, v in sorted(self._phase_bytes.items())]
+            self._histogram(lines, 'ytd_queue_wait_seconds', 'Time jobs waited for a slot.',
+                            'queue', self._queue_wait)
+            lines += ['# HELP ytd_retries_total Download retries.', '# TYPE ytd_retries_total counter']
+            lines += [f'ytd_retries_total{_labels(kind=k)} {v}' for k, v in sorted(self._retries.items())]
+            lines += ['# HELP ytd_jobs_total Finished jobs.', '# TYPE ytd_jobs_total counter']
+            lines += [f'ytd_jobs_total{_labels(source=s, status=t)} {v}' for (s, t), v in sorted(self._jobs.items())]
+            gauges = dict(self._gauges)
+        rss = peak_rss()
+        if rss is not None:
+            lines += ['# HELP ytd_peak_rss_bytes Peak resident set size of the process.',
+                      '# TYPE ytd_peak_rss_bytes gauge', f'ytd_peak_rss_bytes {rss}']
+        for name, (help_text, fn) in sorted(gauges.items()):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+            if isinstance(value, dict):
+                lines += [f'{name}{_labels(key=k)} {v}' for k, v in sorted(value.items())]
+            else:
+                lines.append(f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """Return the process-wide metrics registry."""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics()
+        return _metrics
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import zipfile
+import threading
+from ydl_pool import get_pool
+from file_server import LINK_TTL
+
+PLAYLIST_WORKERS = int(os.environ.get('YTD_PLAYLIST_WORKERS', 3))
+ZIP_BLOCK_SIZE = 1024 * 1024
+
+_LIST_RE = re.compile(r'(?:[?&]list=|/playlist/|/sets/|/album/)([\w-]+)')
+_ARCNAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]+')
+
+
+def is_playlist_url(url):
+    """Cheap check used to offer playlist mode before anything is extracted."""
+    return bool(url and _LIST_RE.search(url))
+
+
+def playlist_key(url, target):
+    """Scheduler key for downloading every entry of url with the same settings."""
+    match = _LIST_RE.search(url)
+    ident = match.group(1) if match else url.strip()
+    payload = json.dumps([ident, target], sort_keys=True, separators=(',', ':'))
+    return 'playlist:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def iter_entries(url, ydl_opts=None):
+    """Yield the flat entries of a playlist page by page, without resolving any video.
+
+    Each entry is a small dict with id, extractor, title, url and duration.
+    A URL that turns out to be a single video yields just that video.
+    """
+    opts = dict(ydl_opts or {}, extract_flat='in_playlist', lazy_playlist=True, noplaylist=False)
+    with get_pool().acquire(opts) as ydl:
+        info = ydl.extract_info(url, download=False, process=False)
+        # watch?v=...&list=... resolves to a reference to the playlist itself
+        for _ in range(3):
+            if info.get('_type') not in ('url', 'url_transparent'):
+                break
+            info = ydl.extract_info(info['url'], download=False, process=False, ie_key=info.get('ie_key'))
+        if info.get('_type') not in ('playlist', 'multi_video'):
+            yield _entry(info, url)
+            return
+        for entry in info.get('entries') or []:
+            if entry:
+                yield _entry(entry)
+
+
+def _entry(entry, url=None):
+    return {
+        'id': entry.get('id'),
+        'extractor': entry.get('ie_key') or entry.get('extractor_key'),
+        'title': entry.get('title') or entry.get('id'),
+        'url': url or entry.get('webpage_url') or entry.get('url'),
+        'duration': entry.get('duration'),
+    }
+
+
+class _ChunkedWriter:
+    """Write-only file object that frames everything as HTTP/1.1 chunks."""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.aborted = False
+
+    def write(self, data):
+        if data and not self.aborted:
+            self.wfile.write(b'%X\r\n%s\r\n' % (len(data), bytes(data)))
+        return len(data)
+
+    def flush(self):
+        if not self.aborted:
+            self.wfile.flush()
+
+    def abort(self):
+        """Drop everything written from now on, so the body stays unterminated."""
+        self.aborted = True
+
+    def finish(self):
+        self.wfile.write(b'0\r\n\r\n')
+
+
+class StreamingZip:
+    """ZIP archive of files that are still being produced, written straight to the client.
+
+    Members are added as their downloads finish and the response streams
+    them in that order, waiting for the next one until close() is called.
+    Files are stored uncompressed (media does not shrink) and read in
+    blocks, so nothing is copied to disk or held in memory. Served by the
+    sidecar's /stream/ route like stream_pipe.PipedStream.
+    Members from cache are pinned for as long as the link lives and held
+    while a response is running, so eviction never drops one.
+    """
+
+    mime = 'application/zip'
+
+    def __init__(self, filename, cache=None):
+        self.filename = filename
+        self.cache = cache
+        self._members = []
+        self._names = set()
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def add(self, path, arcname):
+        arcname = _ARCNAME_RE.sub('_', arcname).strip() or os.path.basename(path)
+        stem, ext = os.path.splitext(arcname)
+        n = 1
+        with self._cond:
+            while arcname in self._names:
+                n += 1
+                arcname = f'{stem} ({n}){ext}'
+            self._names.add(arcname)
+            if self.cache is not None:
+                self.cache.pin(path, LINK_TTL)
+            self._members.append((path, arcname))
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _iter_members(self, held):
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self._members) and not self._closed:
+                    self._cond.wait()
+                if i >= len(self._members):
+                    return
+                # Everything listed so far stays in the cache until the response ends
+                if self.cache is not None:
+                    for path, _ in self._members[len(held):]:
+                        self.cache.hold(path)
+                        held.append(path)
+                member = self._members[i]
+            i += 1
+            yield member
+
+    def serve(self, handler, send_body):
+        """Answer one request on a FileRequestHandler."""
+        handler.send_response(200)
+        handler.send_header('Content-Type', self.mime)
+        handler.send_header('Content-Disposition', handler.content_disposition(self.filename))
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+        if not send_body:
+            return
+        writer = _ChunkedWriter(handler.wfile)
+        held = []
+        try:
+            # An unseekable target makes zipfile write data descriptors after each member
+            with zipfile.ZipFile(writer, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+                for path, arcname in self._iter_members(held):
+                    try:
+                        src = open(path, 'rb')
+                    except OSError:
+                        # Leave the chunked body unterminated so the client sees a failed download
+                        writer.abort()
+                        handler.close_connection = True
+                        return
+                    with src, archive.open(arcname, 'w', force_zip64=True) as dst:
+                        shutil.copyfileobj(src, dst, ZIP_BLOCK_SIZE)
+            writer.finish()
+        except (BrokenPipeError, ConnectionResetError):
+            handler.close_connection = True
+        finally:
+            for path in held:
+                self.cache.release(path)
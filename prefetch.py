@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from metadata_cache import canonical_id, fetch_info, get_cache
+
+PREFETCH_WORKERS = int(os.environ.get('YTD_PREFETCH_WORKERS', 2))
+# A URL that failed to extract is not retried on every rerun within this window.
+FAILURE_TTL = int(os.environ.get('YTD_PREFETCH_FAILURE_TTL', 60))
+
+
+class Prefetcher:
+    """Starts metadata extraction for a URL as soon as it is entered.
+
+    Each session follows at most one URL. Entering another one drops the
+    previous request, and an extraction nobody follows any more is
+    cancelled if it has not started yet. yt-dlp cannot be interrupted once
+    it runs, so at most ``workers`` extractions are in progress; anything
+    they finish still lands in the metadata cache.
+    """
+
+    def __init__(self, workers=PREFETCH_WORKERS, failure_ttl=FAILURE_TTL):
+        self.failure_ttl = failure_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._pending = {}
+        self._sessions = {}
+        # Callbacks of already finished or cancelled futures run while this is held
+        self._lock = threading.RLock()
+
+    def request(self, session, url):
+        """Return a Future of the VideoInfo for url, starting the extraction if needed."""
+        key = canonical_id(url)
+        info = get_cache().get(key)
+        with self._lock:
+            previous = self._sessions.pop(session, None)
+            if previous is not None and previous != key:
+                self._drop(session, previous)
+            if info is not None:
+                future = Future()
+                future.set_result(info)
+                return future
+            self._expire()
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {'future': None, 'sessions': set(), 'finished': None}
+                entry['future'] = self._executor.submit(fetch_info, url)
+                entry['future'].add_done_callback(lambda f, key=key: self._finished(key, f))
+            entry['sessions'].add(session)
+            self._sessions[session] = key
+            return entry['future']
+
+    def _expire(self):
+        cutoff = time.time() - self.failure_ttl
+        for key in [k for k, e in self._pending.items() if e['finished'] and e['finished'] < cutoff]:
+            del self._pending[key]
+
+    def _drop(self, session, key):
+        entry = self._pending.get(key)
+        if entry is None:
+            return
+        entry['sessions'].discard(session)
+        if not entry['sessions'] and entry['future'].cancel():
+            self._pending.pop(key, None)
+
+    def _finished(self, key, future):
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None or entry['future'] is not future:
+                return
+            for session in entry['sessions']:
+                if self._sessions.get(session) == key:
+                    del self._sessions[session]
+            if future.cancelled() or future.exception() is None:
+                # Successful results are served from the metadata cache from now on
+                del self._pending[key]
+            else:
+                entry['finished'] = time.time()
+                entry['sessions'] = set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': sum(1 for e in self._pending.values() if not e['future'].done()),
+                'failed': sum(1 for e in self._pending.values() if e['future'].done()),
+            }
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """Return the process-wide prefetcher."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher()
+        return _prefetcher
@@ -0,0 +1,114 @@
+import os
+import time
+import threading
+
+# Maximum number of progress updates pushed to a UI per second.
+PROGRESS_RATE = float(os.environ.get('YTD_PROGRESS_RATE', 4))
+# Share of the bar reserved for merging/transcoding once all bytes are in.
+POSTPROCESS_SHARE = 0.1
+
+
+def format_bytes(num):
+    """Human readable byte count, e.g. 3.4MiB."""
+    if num is None:
+        return 'N/A'
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(num) < 1024:
+            return f'{num:.1f}{unit}'
+        num /= 1024
+    return f'{num:.1f}TiB'
+
+
+def format_seconds(seconds):
+    if seconds is None:
+        return 'N/A'
+    return time.strftime('%H:%M:%S', time.gmtime(seconds))
+
+
+class ProgressAggregator:
+    """Merges yt-dlp progress and postprocessor callbacks into one throttled figure.
+
+    Works from the raw ``downloaded_bytes``/``total_bytes`` fields. Each
+    downloaded stream (video, audio) is tracked separately and the
+    postprocessing phase gets the last POSTPROCESS_SHARE of the bar, so the
+    combined fraction only ever moves forward. ``callback`` receives a dict
+    with fraction, downloaded, total, speed, eta, elapsed and phase, at most
+    ``rate`` times per second plus once on every phase change.
+    """
+
+    def __init__(self, callback, rate=PROGRESS_RATE, streams=1, postprocess=False):
+        self.callback = callback
+        self.interval = 1.0 / rate if rate else 0
+        self.expected_streams = streams
+        self.postprocess = postprocess
+        self.start = time.time()
+        self.phase = 'queued'
+        self._streams = {}
+        self._speed = None
+        self._postprocessed = 0
+        self._fraction = 0.0
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    def hook(self, d):
+        """yt-dlp progress hook."""
+        key = d.get('filename') or d.get('tmpfilename')
+        total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+        with self._lock:
+            if d['status'] == 'downloading':
+                self._streams[key] = [d.get('downloaded_bytes') or 0, total]
+                self._speed = d.get('speed')
+                self.phase = 'downloading'
+            elif d['status'] == 'finished':
+                done = d.get('total_bytes') or d.get('downloaded_bytes') or total
+                self._streams[key] = [done, done]
+                self.phase = 'downloaded'
+        self._emit(force=d['status'] == 'finished')
+
+    def postprocessor_hook(self, d):
+        """yt-dlp postprocessor hook."""
+        with self._lock:
+            if d['status'] == 'started':
+                self.phase = 'postprocessing'
+            elif d['status'] == 'finished':
+                self._postprocessed += 1
+        self._emit(force=True)
+
+    def finish(self):
+        with self._lock:
+            self._fraction = 1.0
+            self.phase = 'finished'
+        self._emit(force=True)
+
+    def _download_fraction(self):
+        streams = max(self.expected_streams, len(self._streams)) or 1
+        return sum(min(done / total, 1.0) for done, total in self._streams.values() if total) / streams
+
+    def snapshot(self):
+        with self._lock:
+            share = 1.0 - POSTPROCESS_SHARE if self.postprocess else 1.0
+            fraction = self._download_fraction() * share
+            if self.postprocess and self._postprocessed:
+                # Number of postprocessors is not known up front; approach the end asymptotically
+                fraction += POSTPROCESS_SHARE * self._postprocessed / (self._postprocessed + 1)
+            self._fraction = max(self._fraction, min(fraction, 1.0))
+            downloaded = sum(done for done, _ in self._streams.values())
+            total = sum(total for _, total in self._streams.values())
+            speed = self._speed if self.phase == 'downloading' else None
+            eta = (total - downloaded) / speed if speed and total > downloaded else None
+            return {
+                'fraction': self._fraction,
+                'downloaded': downloaded,
+                'total': total,
+                'speed': speed,
+                'eta': eta,
+                'elapsed': time.time() - self.start,
+                'phase': self.phase,
+            }
+
+    def _emit(self, force=False):
+        now = time.time()
+        if not force and now - self._last_emit < self.interval:
+            return
+        self._last_emit = now
+        self.callback(self.snapshot())
@@ -0,0 +1,346 @@
+import os
+import ssl
+import time
+import queue
+import threading
+import http.client
+from urllib.parse import urlsplit, urljoin
+from urllib.request import getproxies, proxy_bypass
+from bandwidth import ADAPT_INTERVAL, get_budget
+
+MAX_CONNECTIONS = int(os.environ.get('YTD_RANGE_CONNECTIONS', 8))
+MIN_PIECE = 1024 * 1024
+# Some CDNs throttle single range requests above ~10MB.
+MAX_PIECE = 10 * 1024 * 1024
+BLOCK_SIZE = 256 * 1024
+RETRIES = 10
+TIMEOUT = 30
+# yt-dlp options that change how it connects, which plain http.client cannot follow.
+NETWORK_OPTIONS = ('proxy', 'cookiefile', 'cookiesfrombrowser', 'source_address')
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def is_rangeable(fmt, params=None):
+    """Whether a format is a single plain HTTP(S) file RangeDownloader can fetch.
+
+    params are the yt-dlp options of the download; a proxy, cookie jar or
+    source address there (or a proxy from the environment) leaves the
+    format to yt-dlp, which honours them.
+    """
+    if fmt.get('protocol') not in ('http', 'https') or not fmt.get('url') or fmt.get('fragments'):
+        return False
+    if params and any(params.get(key) for key in NETWORK_OPTIONS):
+        return False
+    parts = urlsplit(fmt['url'])
+    return not (parts.scheme in getproxies() and not proxy_bypass(parts.hostname or ''))
+
+
+def format_headers(fmt):
+    """HTTP headers for fetching fmt, with the cookies yt-dlp scoped to its URL."""
+    headers = dict(fmt.get('http_headers') or {})
+    if fmt.get('cookies'):
+        # Deferred like every yt-dlp import outside the download path
+        from yt_dlp.cookies import LenientSimpleCookie
+        cookies = LenientSimpleCookie(fmt['cookies'])
+        headers['Cookie'] = '; '.join(f'{c.key}={c.coded_value}' for c in cookies.values())
+    return headers
+
+
+def connect(url, timeout=TIMEOUT):
+    parts = urlsplit(url)
+    if parts.scheme == 'https':
+        return http.client.HTTPSConnection(parts.netloc, timeout=timeout, context=ssl.create_default_context())
+    return http.client.HTTPConnection(parts.netloc, timeout=timeout)
+
+
+def _target(url):
+    parts = urlsplit(url)
+    return (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+
+def request(conn, url, headers, timeout=TIMEOUT, method='GET'):
+    """Send one request, following redirects; returns (conn, final url, response)."""
+    for _ in range(5):
+        conn.request(method, _target(url), headers=headers)
+        response = conn.getresponse()
+        if response.status in (301, 302, 303, 307, 308):
+            location = response.getheader('Location')
+            response.read()
+            conn.close()
+            target = urljoin(url, location)
+            if urlsplit(target).netloc != urlsplit(url).netloc:
+                # Cookies are scoped to the host they came for
+                headers = {k: v for k, v in headers.items() if k.lower() != 'cookie'}
+            url = target
+            conn = connect(url, timeout)
+            continue
+        return conn, url, response
+    raise http.client.HTTPException('Too many redirects')
+
+
+class RangeDownloader:
+    """Fetches one known-length resource as concurrent byte ranges.
+
+    Pieces are pulled from a shared queue by worker threads, each holding a
+    keep-alive connection, and written with os.pwrite straight into a
+    preallocated file. A failed piece is retried on its own from the last
+    byte received. Connections are leased from the node budget; their
+    number starts at what worked last for the host and then follows an
+    AdaptiveController, which adds one while that still raises throughput
+    and retires one when throughput or latency get worse. Reads are sized
+    by the controller and count against the node's bandwidth.
+    """
+
+    def __init__(self, url, path, size=None, headers=None, max_connections=MAX_CONNECTIONS,
+                 initial_connections=2, retries=RETRIES, timeout=TIMEOUT, progress_hook=None,
+                 piece_size=None, budget=None):
+        self.url = url
+        self.path = path
+        self.size = size
+        self.headers = dict(headers or {})
+        self.max_connections = max_connections
+        self.initial_connections = min(initial_connections, max_connections)
+        self.retries = retries
+        self.timeout = timeout
+        self.progress_hook = progress_hook
+        self.piece_size = piece_size
+        self.budget = budget or get_budget()
+        self.controller = None
+        self.downloaded = 0
+        self.retry_count = 0
+        self.connections = 0
+        self._target = 0
+        self._retiring = 0
+        self._pieces = queue.Queue()
+        self._lock = threading.Lock()
+        self._error = None
+        self._workers = []
+        self._worker_exited = threading.Event()
+        self._start = None
+        self._unranged = None
+
+    def _request(self, conn, url, headers, method='GET'):
+        return request(conn, url, {**self.headers, **headers}, self.timeout, method)
+
+    def probe(self):
+        """Resolve redirects and the total size; raises RangeNotSupported if ranges are ignored."""
+        conn = connect(self.url, self.timeout)
+        try:
+            conn, self.url, response = self._request(conn, self.url, {'Range': 'bytes=0-0'})
+            if response.status == 200:
+                # Range ignored: this response is the whole file, _single_stream reads it
+                self._unranged, conn = (conn, response), None
+                raise RangeNotSupported('Range request answered with the whole file')
+            if response.status != 206:
+                # Closed below without reading whatever body came with it
+                raise RangeNotSupported(f'HTTP {response.status} for a range request')
+            response.read()
+            content_range = response.getheader('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            if total.isdigit():
+                self.size = int(total)
+            if not self.size:
+                raise RangeNotSupported('Unknown content length')
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def run(self):
+        """Download to self.path and return the number of bytes written."""
+        self._start = time.time()
+        self.controller = self.budget.controller(self.url, self.initial_connections)
+        self.budget.start_transfer()
+        try:
+            try:
+                self.probe()
+            except RangeNotSupported:
+                return self._single_stream()
+            return self._ranges()
+        finally:
+            self.budget.end_transfer()
+            self.controller.close()
+
+    def _ranges(self):
+        piece = self.piece_size or min(max(self.size // (self.max_connections * 4), MIN_PIECE), MAX_PIECE)
+        for offset in range(0, self.size, piece):
+            self._pieces.put([offset, min(offset + piece, self.size) - 1])
+        with open(self.path, 'wb') as f:
+            f.truncate(self.size)
+            try:
+                os.posix_fallocate(f.fileno(), 0, self.size)
+            except (AttributeError, OSError):
+                pass
+            fd = f.fileno()
+            wanted = min(self.controller.target, self.max_connections)
+            self._target = self.budget.lease(wanted, minimum=1)
+            for _ in range(self._target):
+                self._add_worker(fd)
+            self._adapt(fd)
+            for worker in self._workers:
+                worker.join()
+        if self._error:
+            raise self._error
+        self._report('finished')
+        return self.downloaded
+
+    def _add_worker(self, fd):
+        worker = threading.Thread(target=self._worker, args=(fd,), daemon=True)
+        self._workers.append(worker)
+        with self._lock:
+            self.connections += 1
+        worker.start()
+
+    def _adapt(self, fd):
+        """Move the connection count to the controller's target every interval."""
+        last_bytes, last_time = self.downloaded, time.time()
+        while any(w.is_alive() for w in self._workers):
+            self._worker_exited.wait(ADAPT_INTERVAL)
+            self._worker_exited.clear()
+            now = time.time()
+            if now - last_time < ADAPT_INTERVAL:
+                continue
+            rate = (self.downloaded - last_bytes) / (now - last_time)
+            last_bytes, last_time = self.downloaded, now
+            if self._pieces.empty() or self._error:
+                continue
+            with self._lock:
+                running = self.connections - self._retiring
+            self._target = min(self.controller.plan(running, rate), self.max_connections)
+            # Surplus workers retire after their current piece (see _retire)
+            if self._target > running and self.budget.lease(1):
+                self._add_worker(fd)
+
+    def _retire(self):
+        # Whether the calling worker should stop because the target went down
+        with self._lock:
+            if self.connections - self._retiring > self._target:
+                self._retiring += 1
+                return True
+            return False
+
+    def _worker(self, fd):
+        conn = connect(self.url, self.timeout)
+        url = self.url
+        retired = False
+        try:
+            while self._error is None:
+                if self._retire():
+                    retired = True
+                    return
+                try:
+                    piece = self._pieces.get_nowait()
+                except queue.Empty:
+                    return
+                attempts = 0
+                while True:
+                    try:
+                        conn, url = self._fetch(conn, url, fd, piece)
+                        break
+                    except (OSError, http.client.HTTPException) as e:
+                        attempts += 1
+                        with self._lock:
+                            self.retry_count += 1
+                        conn.close()
+                        if attempts > self.retries:
+                            self._error = e
+                            return
+                        time.sleep(min(2 ** attempts * 0.1, 5))
+                        conn = connect(url, self.timeout)
+        finally:
+            conn.close()
+            with self._lock:
+                self.connections -= 1
+                if retired:
+                    self._retiring -= 1
+            self.budget.release(1)
+            self._worker_exited.set()
+
+    def _fetch(self, conn, url, fd, piece):
+        start, end = piece
+        sent = time.monotonic()
+        conn, url, response = self._request(conn, url, {'Range': f'bytes={start}-{end}'})
+        self.controller.observe_latency(time.monotonic() - sent)
+        if response.status != 206:
+            # The worker drops this connection, so a full-file body is never read
+            raise http.client.HTTPException(f'HTTP {response.status} for range {start}-{end}')
+        while start <= end:
+            block = response.read(min(self.controller.buffer_size(), end - start + 1))
+            if not block:
+                raise http.client.IncompleteRead(b'', end - start + 1)
+            self.controller.consume(len(block))
+            os.pwrite(fd, block, start)
+            start += len(block)
+            # Remember progress so a retry resumes where this attempt stopped
+            piece[0] = start
+            with self._lock:
+                self.downloaded += len(block)
+            self._report('downloading')
+        return conn, url
+
+    def _single_stream(self):
+        """Fallback for servers without range support."""
+        self.budget.lease(1, minimum=1)
+        # The probe's answer, if it already carries the whole file
+        conn, response = self._unranged or (connect(self.url, self.timeout), None)
+        self._unranged = None
+        try:
+            if response is None:
+                conn, self.url, response = self._request(conn, self.url, {})
+            if response.status != 200:
+                raise http.client.HTTPException(f'HTTP {response.status}')
+            self.size = self.size or int(response.getheader('Content-Length') or 0) or None
+            self.connections = 1
+            with open(self.path, 'wb') as f:
+                while True:
+                    block = response.read(BLOCK_SIZE)
+                    if not block:
+                        break
+                    self.controller.consume(len(block))
+                    f.write(block)
+                    self.downloaded += len(block)
+                    self._report('downloading')
+        finally:
+            conn.close()
+            self.budget.release(1)
+        self._report('finished')
+        return self.downloaded
+
+    def _report(self, status):
+        if self.progress_hook is None:
+            return
+        elapsed = time.time() - self._start
+        self.progress_hook({
+            'status': status,
+            'filename': self.path,
+            'downloaded_bytes': self.downloaded,
+            'retries': self.retry_count,
+            'total_bytes': self.size,
+            'speed': self.downloaded / elapsed if elapsed > 0 else None,
+            'elapsed': elapsed,
+        })
+
+
+def download_format(ydl, info, fmt, progress_hook=None, filename=None, **kwargs):
+    """Fetch one progressive format to filename, or the path yt-dlp would have used.
+
+    If the range download fails, the format is fetched again by yt-dlp's
+    own downloader, which reports through the progress hooks of ydl.
+    """
+    filename = filename or ydl.prepare_filename(dict(info.fields(), **fmt))
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    downloader = RangeDownloader(
+        fmt['url'], filename, size=fmt.get('filesize'), headers=format_headers(fmt),
+        progress_hook=progress_hook, **kwargs)
+    try:
+        downloader.run()
+    except Exception as e:
+        ydl.report_warning(f"Range download of format {fmt.get('format_id')} failed ({e}), retrying with yt-dlp")
+        # yt-dlp would take a complete-looking file for an earlier download
+        if os.path.exists(filename):
+            os.remove(filename)
+        if not ydl.dl(filename, dict(info.fields(), **fmt)):
+            raise RuntimeError(f"Download of format {fmt.get('format_id')} failed") from e
+    return filename
@@ -0,0 +1,167 @@
+import os
+import shutil
+import threading
+import subprocess
+import http.client
+from bandwidth import get_budget
+from range_download import BLOCK_SIZE, connect, format_headers, request, is_rangeable
+from transcode import PIPE_MP4_FLAGS, ffmpeg_command, metadata_from_info
+
+# Concurrent streams; each holds one origin connection and at most one ffmpeg.
+STREAM_SLOTS = int(os.environ.get('YTD_STREAM_SLOTS', 4))
+# Muxer and MIME type per output extension when ffmpeg writes to a pipe.
+PIPE_FORMATS = {
+    'mp3': ('mp3', 'audio/mpeg'),
+    'm4a': ('ipod', 'audio/mp4'),
+    'mp4': ('mp4', 'video/mp4'),
+}
+
+_slots = threading.BoundedSemaphore(STREAM_SLOTS)
+
+
+def can_stream(plan):
+    """Whether a plan can be relayed without a file: one plain HTTP source, no merge."""
+    if plan is None or plan.merge or not is_rangeable(plan.formats[0]):
+        return False
+    return not _needs_ffmpeg(plan) or (shutil.which('ffmpeg') is not None and plan.ext in PIPE_FORMATS)
+
+
+def _needs_ffmpeg(plan):
+    # Audio plans always write tags; video only needs ffmpeg to change container
+    return plan.video is None or plan.remux
+
+
+class PipedStream:
+    """Relays one format from its origin to an HTTP client, through ffmpeg if needed.
+
+    Nothing is written to disk. Bytes are moved one block at a time and the
+    origin read blocks while ffmpeg or the client are behind, so each stream
+    holds a few blocks plus the OS pipe buffers regardless of file size.
+    Untouched sources are passed through with the client's Range header;
+    ffmpeg output has no known length and is sent chunked.
+    """
+
+    def __init__(self, plan, info):
+        self.plan = plan
+        self.info = info
+        self.format = plan.formats[0]
+        self.filename = f"{info.title or info.id or 'download'}.{plan.ext}"
+        self.mime = PIPE_FORMATS.get(plan.ext, (None, 'application/octet-stream'))[1]
+
+    def command(self):
+        muxer = PIPE_FORMATS[self.plan.ext][0]
+        if self.plan.video is None:
+            return ffmpeg_command('pipe:0', 'pipe:1', self.plan, metadata_from_info(self.info), muxer)
+        return [shutil.which('ffmpeg') or 'ffmpeg', '-nostdin', '-loglevel', 'error', '-i', 'pipe:0',
+                '-map', '0', '-c', 'copy', '-f', muxer] + PIPE_MP4_FLAGS + ['pipe:1']
+
+    def _open(self, headers=None):
+        url = self.format['url']
+        conn = connect(url)
+        conn, url, response = request(conn, url, {**format_headers(self.format), **(headers or {})})
+        return conn, response
+
+    def serve(self, handler, send_body):
+        """Answer one request on a FileRequestHandler."""
+        if not _slots.acquire(blocking=False):
+            handler.send_response(503)
+            handler.send_header('Retry-After', '5')
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        try:
+            if _needs_ffmpeg(self.plan):
+                self._serve_piped(handler, send_body)
+            else:
+                self._serve_direct(handler, send_body)
+        except (BrokenPipeError, ConnectionResetError):
+            handler.close_connection = True
+        finally:
+            _slots.release()
+
+    def _send_headers(self, handler, status, extra):
+        handler.send_response(status)
+        handler.send_header('Content-Type', self.mime)
+        handler.send_header('Content-Disposition', handler.content_disposition(self.filename))
+        for key, value in extra.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+
+    def _serve_direct(self, handler, send_body):
+        range_header = handler.headers.get('Range')
+        conn, response = self._open({'Range': range_header} if range_header else None)
+        try:
+            if response.status not in (200, 206, 416):
+                handler.send_error(502, f'Origin answered HTTP {response.status}')
+                return
+            extra = {'Accept-Ranges': 'bytes'}
+            for key in ('Content-Length', 'Content-Range'):
+                if response.getheader(key):
+                    extra[key] = response.getheader(key)
+            self._send_headers(handler, response.status, extra)
+            if not send_body:
+                return
+            while True:
+                block = response.read(BLOCK_SIZE)
+                if not block:
+                    break
+                # Relayed bytes share the node bandwidth with the downloads
+                get_budget().consume(len(block))
+                handler.wfile.write(block)
+        finally:
+            conn.close()
+
+    def _serve_piped(self, handler, send_body):
+        if not send_body:
+            # Same headers as a GET, but a HEAD response never carries a body
+            self._send_headers(handler, 200, {'Transfer-Encoding': 'chunked'})
+            return
+        conn, response = self._open()
+        if response.status != 200:
+            conn.close()
+            handler.send_error(502, f'Origin answered HTTP {response.status}')
+            return
+        proc = subprocess.Popen(self.command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL)
+        fed = {}
+        feeder = threading.Thread(target=self._feed, args=(response, proc.stdin, fed), daemon=True)
+        feeder.start()
+        try:
+            self._send_headers(handler, 200, {'Transfer-Encoding': 'chunked'})
+            while True:
+                block = proc.stdout.read1(BLOCK_SIZE)
+                if not block:
+                    break
+                handler.wfile.write(b'%X\r\n%s\r\n' % (len(block), block))
+            feeder.join()
+            if proc.wait() != 0 or not fed.get('complete'):
+                # Leave the chunked body unterminated so the client sees a failed download
+                handler.close_connection = True
+                return
+            handler.wfile.write(b'0\r\n\r\n')
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+            proc.stdout.close()
+            conn.close()
+            feeder.join()
+
+    @staticmethod
+    def _feed(response, stdin, state):
+        try:
+            while True:
+                block = response.read(BLOCK_SIZE)
+                if not block:
+                    break
+                get_budget().consume(len(block))
+                stdin.write(block)
+            state['complete'] = True
+        except (OSError, ValueError, http.client.HTTPException):
+            # ffmpeg exited or the origin dropped; the reader side ends the response
+            pass
+        finally:
+            try:
+                stdin.close()
+            except OSError:
+                pass
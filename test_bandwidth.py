@@ -0,0 +1,123 @@
+"""AdaptiveController and NodeBudget driving RangeDownloader against a shaped local server.
+
+    python -m unittest test_bandwidth
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from bandwidth import NodeBudget
+from file_server import FileRequestHandler
+from range_download import RangeDownloader
+
+MB = 1024 * 1024
+SIZE = 20 * MB
+PIECE = MB
+CONNECTION_RATE = 2 * MB
+LATENCY = 0.02
+
+
+class _Registry:
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, token):
+        return self.path, 'media.bin', 'application/octet-stream'
+
+
+class ShapedHandler(FileRequestHandler):
+    """Adds latency to every request and limits every connection to CONNECTION_RATE."""
+
+    def setup(self):
+        super().setup()
+        # One handler per connection, paced from its first byte, so no piece gets a free burst
+        self._sent = 0
+        self._since = None
+
+    def _serve(self, send_body):
+        time.sleep(LATENCY)
+        super()._serve(send_body)
+
+    def _send_range(self, f, offset, count):
+        f.seek(offset)
+        if self._since is None:
+            self._since = time.monotonic()
+        try:
+            while count > 0:
+                chunk = f.read(min(count, 64 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                count -= len(chunk)
+                self._sent += len(chunk)
+                ahead = self._sent / CONNECTION_RATE - (time.monotonic() - self._since)
+                if ahead > 0:
+                    time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+class AdaptiveControllerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='ytd-bandwidth-test-')
+        cls.source = os.path.join(cls.root, 'source.bin')
+        with open(cls.source, 'wb') as f:
+            f.write(os.urandom(SIZE))
+        cls.handler = type('Handler', (ShapedHandler,), {'registry': _Registry(cls.source)})
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), cls.handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/files/token/media.bin'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.target = os.path.join(self.root, 'out.bin')
+
+    def tearDown(self):
+        if os.path.exists(self.target):
+            os.remove(self.target)
+
+    def download(self, budget):
+        peak = [0]
+
+        def hook(d):
+            peak[0] = max(peak[0], downloader.connections)
+
+        downloader = RangeDownloader(self.url, self.target, piece_size=PIECE, budget=budget,
+                                     initial_connections=2, progress_hook=hook)
+        started = time.monotonic()
+        self.assertEqual(downloader.run(), SIZE)
+        elapsed = time.monotonic() - started
+        with open(self.source, 'rb') as a, open(self.target, 'rb') as b:
+            self.assertTrue(a.read() == b.read(), 'output differs from the source')
+        self.assertEqual(budget.in_use, 0)
+        return peak[0], elapsed
+
+    def test_adds_connections_while_they_help(self):
+        peak, elapsed = self.download(NodeBudget(rate=0, connections=8))
+        # Two connections alone would need SIZE / (2 * CONNECTION_RATE) seconds
+        self.assertGreater(peak, 2)
+        self.assertLess(elapsed, SIZE / (2 * CONNECTION_RATE))
+
+    def test_stays_within_node_rate(self):
+        rate = 3 * MB
+        budget = NodeBudget(rate=rate, connections=8)
+        _, elapsed = self.download(budget)
+        # Never faster than the cap (the node budget starts with one second
+        # of allowance), and still close to it
+        self.assertGreaterEqual(elapsed, (SIZE - rate) / rate * 0.95)
+        self.assertLess(elapsed, SIZE / rate * 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+"""RangeDownloader against a local file_server with injected faults.
+
+    python -m unittest test_range_download
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import ThreadingHTTPServer
+from yt_dlp import YoutubeDL
+from bandwidth import NodeBudget
+from file_server import FileRequestHandler
+from range_download import RangeDownloader, download_format
+from video_info import VideoInfo
+
+SIZE = 4 * 1024 * 1024 + 12345
+PIECE = 512 * 1024
+
+
+class _Registry:
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, token):
+        return self.path, 'media.bin', 'application/octet-stream'
+
+
+class FaultyHandler(FileRequestHandler):
+    """Serves the registered file, optionally ignoring Range or cutting ranges short."""
+
+    ignore_range = False
+    drops = 0
+    ranges = []
+    cuts = []
+    served = 0
+    lock = threading.Lock()
+
+    def _serve(self, send_body):
+        if self.ignore_range:
+            del self.headers['Range']
+        elif self.headers.get('Range'):
+            with self.lock:
+                self.ranges.append(self.headers['Range'])
+        super()._serve(send_body)
+
+    def _send_range(self, f, offset, count):
+        cls = type(self)
+        with cls.lock:
+            # The 0-0 probe and plain GETs are never dropped
+            drop = cls.drops > 0 and count > 1 and bool(self.headers.get('Range'))
+            if drop:
+                cls.drops -= 1
+                cls.cuts.append(offset + count // 2)
+            else:
+                cls.served += count
+        if not drop:
+            return super()._send_range(f, offset, count)
+        f.seek(offset)
+        self.wfile.write(f.read(count // 2))
+        self.close_connection = True
+
+
+class RangeDownloaderTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp(prefix='ytd-range-test-')
+        cls.source = os.path.join(cls.root, 'source.bin')
+        with open(cls.source, 'wb') as f:
+            f.write(os.urandom(SIZE))
+        handler = type('Handler', (FaultyHandler,), {'registry': _Registry(cls.source)})
+        cls.handler = handler
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f'http://127.0.0.1:{cls.server.server_address[1]}/files/token/media.bin'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.root, ignore_errors=True)
+
+    def setUp(self):
+        self.handler.ignore_range = False
+        self.handler.drops = 0
+        self.handler.ranges = []
+        self.handler.cuts = []
+        self.handler.served = 0
+        self.budget = NodeBudget(rate=0, connections=8)
+        self.target = os.path.join(self.root, 'out.bin')
+
+    def tearDown(self):
+        if os.path.exists(self.target):
+            os.remove(self.target)
+
+    def download(self):
+        downloader = RangeDownloader(self.url, self.target, piece_size=PIECE, budget=self.budget)
+        written = downloader.run()
+        self.assertEqual(written, SIZE)
+        with open(self.source, 'rb') as a, open(self.target, 'rb') as b:
+            self.assertTrue(a.read() == b.read(), 'output differs from the source')
+        self.assertEqual(self.budget.in_use, 0)
+        return downloader
+
+    def test_ranges(self):
+        downloader = self.download()
+        self.assertEqual(downloader.retry_count, 0)
+        self.assertGreater(len(self.handler.ranges), SIZE // PIECE)
+
+    def test_dropped_connections_resume_the_piece(self):
+        self.handler.drops = 3
+        downloader = self.download()
+        self.assertEqual(downloader.retry_count, 3)
+        # Every cut piece was asked for again from the first missing byte only
+        starts = [int(r.split('=')[1].split('-')[0]) for r in self.handler.ranges]
+        self.assertEqual(sorted(s for s in starts if s % PIECE), sorted(self.handler.cuts))
+        self.assertEqual(downloader.downloaded, SIZE)
+
+    def test_server_without_ranges(self):
+        self.handler.ignore_range = True
+        downloader = self.download()
+        self.assertEqual(downloader.connections, 1)
+        # The probe's full answer is the download; the file crosses the wire once
+        self.assertEqual(self.handler.served, SIZE)
+
+    def test_failed_range_download_falls_back_to_yt_dlp(self):
+        self.handler.drops = 1000
+        fmt = {'format_id': 'http', 'url': self.url, 'protocol': 'http', 'ext': 'bin'}
+        with YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+            download_format(ydl, VideoInfo(id='media', title='media'), fmt, filename=self.target,
+                            retries=0, budget=self.budget)
+        with open(self.source, 'rb') as a, open(self.target, 'rb') as b:
+            self.assertTrue(a.read() == b.read(), 'output differs from the source')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import time
+import shutil
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+TRANSCODE_WORKERS = int(os.environ.get('YTD_TRANSCODE_WORKERS', os.cpu_count() or 2))
+# Stages of a timing record that summary() reports.
+STAGES = ('download', 'queue_wait', 'encode')
+
+ENCODERS = {
+    'mp3': ['-c:a', 'libmp3lame', '-id3v2_version', '3'],
+    'aac': ['-c:a', 'aac', '-movflags', '+faststart'],
+    'm4a': ['-c:a', 'aac', '-movflags', '+faststart'],
+}
+# MP4 muxers and the flags that let them write to a non-seekable pipe.
+PIPE_MP4_FORMATS = ('mp4', 'ipod')
+PIPE_MP4_FLAGS = ['-movflags', '+frag_keyframe+empty_moov+default_base_moof']
+
+
+def metadata_from_info(info):
+    """Tags written by the encoder, mirroring what FFmpegMetadata would add."""
+    upload_date = info.upload_date or ''
+    tags = {
+        'title': info.track or info.title,
+        'artist': info.artist or info.creator or info.uploader,
+        'album': info.album,
+        'genre': info.genre,
+        'date': upload_date[:4] if upload_date else None,
+        'comment': info.webpage_url,
+    }
+    return {k: str(v) for k, v in tags.items() if v}
+
+
+def ffmpeg_command(src, dst, plan, metadata, output_format=None):
+    """One ffmpeg pass that encodes (or copies) the audio and writes the tags.
+
+    output_format is required when dst is a pipe: the muxer cannot be
+    guessed from the name, and MP4 has to be written fragmented because
+    the header cannot be moved to the front afterwards.
+    """
+    cmd = [shutil.which('ffmpeg') or 'ffmpeg', '-y', '-nostdin', '-loglevel', 'error',
+           '-i', src, '-vn', '-map_metadata', '-1']
+    for key, value in metadata.items():
+        cmd += ['-metadata', f'{key}={value}']
+    if plan.transcode:
+        cmd += ENCODERS.get(plan.codec, []) + ['-b:a', f'{plan.bitrate}k']
+    else:
+        cmd += ['-c:a', 'copy']
+    if output_format:
+        cmd += ['-f', output_format]
+        if output_format in PIPE_MP4_FORMATS:
+            cmd += PIPE_MP4_FLAGS
+    return cmd + [dst]
+
+
+class TranscodePipeline:
+    """Queue of finished downloads feeding a fixed pool of ffmpeg encoders.
+
+    Callers hand over a raw audio file and go on with their next download;
+    each worker runs one ffmpeg process at a time, so at most ``workers``
+    encoders use the CPU at once. Timings are kept as running totals per
+    stage, so a long-lived pipeline does not grow with every file.
+    """
+
+    def __init__(self, workers=TRANSCODE_WORKERS):
+        self.workers = workers
+        self.files = 0
+        self._totals = {stage: [0.0, 0] for stage in STAGES}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ffmpeg')
+        self._lock = threading.Lock()
+
+    def submit(self, src, plan, info, download_time=None):
+        """Queue src for encoding according to an audio plan; returns a Future of the timing record."""
+        return self._executor.submit(self._encode, src, plan, info, time.time(), download_time)
+
+    def _encode(self, src, plan, info, queued_at, download_time):
+        started = time.time()
+        dst = f'{os.path.splitext(src)[0]}.{plan.ext}'
+        tmp = f'{os.path.splitext(src)[0]}.encoding.{plan.ext}'
+        result = subprocess.run(ffmpeg_command(src, tmp, plan, metadata_from_info(info)),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+        os.replace(tmp, dst)
+        if os.path.abspath(src) != os.path.abspath(dst):
+            os.remove(src)
+        timing = {
+            'output': dst,
+            'download': download_time,
+            'queue_wait': started - queued_at,
+            'encode': time.time() - started,
+            'bytes': os.path.getsize(dst),
+        }
+        with self._lock:
+            self.files += 1
+            for stage in STAGES:
+                if timing[stage] is not None:
+                    self._totals[stage][0] += timing[stage]
+                    self._totals[stage][1] += 1
+        return timing
+
+    def summary(self):
+        """Totals and means per stage over every file encoded so far."""
+        with self._lock:
+            summary = {'files': self.files}
+            for stage, (total, count) in self._totals.items():
+                summary[stage] = {
+                    'total': total,
+                    'mean': total / count if count else 0.0,
+                }
+        return summary
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline():
+    """Return the process-wide transcoding pipeline."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = TranscodePipeline()
+        return _pipeline
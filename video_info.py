@@ -0,0 +1,170 @@
+import sys
+
+# Top-level fields the frontends, the planner and the tag writer read.
+FIELDS = ('id', 'title', 'duration', 'duration_string', 'view_count', 'uploader', 'thumbnail',
+          'extractor', 'extractor_key', 'webpage_url', 'upload_date',
+          'track', 'artist', 'creator', 'album', 'genre')
+# Other top-level scalars longer than this (descriptions, manifest URLs) are dropped.
+MAX_EXTRA_LENGTH = 256
+# Per-format compound values that repeat across formats and are stored once.
+FORMAT_COMPOUND_KEYS = ('http_headers', 'fragments', 'downloader_options')
+# Per-format strings repeated across formats (codecs, protocols) are shared.
+MAX_INTERN_LENGTH = 64
+
+_SCALARS = (str, int, float, bool)
+
+
+def _intern(value):
+    if isinstance(value, str) and len(value) <= MAX_INTERN_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+def _chapters(chapters):
+    return tuple((c.get('start_time'), c.get('end_time'), c.get('title')) for c in chapters or [] if c)
+
+
+class FormatTable:
+    """The formats of one video stored column by column.
+
+    yt-dlp keeps one dict per format, each with its own copy of keys,
+    codec strings and request headers. Here every field is one list with a
+    slot per format, short strings are interned and identical header dicts
+    are stored once. Any other value, including extractor-private keys
+    such as _decryption_key_url, is kept verbatim for the downloader; only
+    the internal ``__`` keys yt-dlp itself strips are dropped. Rows are
+    rebuilt as plain dicts on access, which only happens while planning or
+    starting a download.
+    """
+
+    __slots__ = ('_columns', '_count')
+
+    def __init__(self, columns=None, count=0):
+        self._columns = columns or {}
+        self._count = count
+
+    @classmethod
+    def from_formats(cls, formats):
+        formats = [f for f in formats or [] if f]
+        shared = {}
+        columns = {}
+        for i, f in enumerate(formats):
+            for key, value in f.items():
+                if value is None or key.startswith('__'):
+                    continue
+                if key in FORMAT_COMPOUND_KEYS:
+                    value = cls._share(shared, value)
+                elif isinstance(value, _SCALARS):
+                    value = _intern(value)
+                column = columns.get(key)
+                if column is None:
+                    column = columns[sys.intern(key)] = [None] * len(formats)
+                column[i] = value
+        return cls(columns, len(formats))
+
+    @staticmethod
+    def _share(shared, value):
+        if not isinstance(value, dict):
+            return value
+        try:
+            ident = tuple(sorted(value.items()))
+            return shared.setdefault(ident, value)
+        except TypeError:
+            return value
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if not -self._count <= i < self._count:
+            raise IndexError(i)
+        return {k: c[i] for k, c in self._columns.items() if c[i] is not None}
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    def column(self, key):
+        """Values of one field for every format, None where missing."""
+        return list(self._columns.get(key) or [None] * self._count)
+
+    def to_json(self):
+        return {'count': self._count, 'columns': self._columns}
+
+    @classmethod
+    def from_json(cls, data):
+        if not data:
+            return cls()
+        shared = {}
+        columns = {}
+        for key, column in data['columns'].items():
+            if key in FORMAT_COMPOUND_KEYS:
+                # Loaded back as one dict per format; share them again like from_formats
+                columns[sys.intern(key)] = [cls._share(shared, v) for v in column]
+            else:
+                columns[sys.intern(key)] = [_intern(v) for v in column]
+        return cls(columns, data['count'])
+
+
+class VideoInfo:
+    """Compact record of one extracted video, built once from yt-dlp's info dict.
+
+    Keeps the fields listed in FIELDS as attributes, the formats as a
+    FormatTable and any other short top-level scalar yt-dlp may want again
+    when downloading (live status, timestamps, ...) in ``extra``. Chapters
+    are kept as (start, end, title) tuples. Subtitle and caption tables,
+    thumbnail lists, heatmaps and descriptions are dropped, which is most
+    of a YouTube info dict.
+    """
+
+    __slots__ = FIELDS + ('chapters', 'formats', 'extra')
+
+    def __init__(self, formats=None, extra=None, chapters=(), **fields):
+        for name in FIELDS:
+            setattr(self, name, fields.get(name))
+        self.chapters = tuple(chapters)
+        self.formats = formats if formats is not None else FormatTable()
+        self.extra = extra or {}
+
+    @classmethod
+    def from_info(cls, info):
+        """Build from a sanitized info dict; the dict can be dropped afterwards."""
+        fields = {name: _intern(info.get(name)) for name in FIELDS}
+        extra = {}
+        for key, value in info.items():
+            if key in FIELDS or key.startswith('_') or not isinstance(value, _SCALARS):
+                continue
+            if isinstance(value, str) and len(value) > MAX_EXTRA_LENGTH:
+                continue
+            extra[sys.intern(key)] = _intern(value)
+        return cls(FormatTable.from_formats(info.get('formats')), extra,
+                   _chapters(info.get('chapters')), **fields)
+
+    def fields(self):
+        """Top-level fields as a dict, e.g. for output templates; no formats."""
+        fields = dict(self.extra)
+        for name in FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                fields[name] = value
+        if self.chapters:
+            fields['chapters'] = [{'start_time': start, 'end_time': end, 'title': title}
+                                  for start, end, title in self.chapters]
+        return fields
+
+    def to_info(self):
+        """A minimal info dict yt-dlp can process and download again."""
+        info = self.fields()
+        if len(self.formats):
+            info['formats'] = list(self.formats)
+        return info
+
+    def to_json(self):
+        return {'fields': self.fields(), 'formats': self.formats.to_json()}
+
+    @classmethod
+    def from_json(cls, data):
+        fields = data.get('fields') or {}
+        extra = {k: v for k, v in fields.items() if k not in FIELDS and k != 'chapters'}
+        return cls(FormatTable.from_json(data.get('formats')), extra, _chapters(fields.get('chapters')),
+                   **{k: _intern(v) for k, v in fields.items() if k in FIELDS})
@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+from progress import format_bytes
+
+# Where jobs download, merge and encode; e.g. a directory on /dev/shm for tmpfs.
+WORKSPACE_DIR = os.environ.get('YTD_WORKSPACE_DIR', os.path.join('.cache', 'work'))
+# Free space kept on the workspace filesystem besides what admitted jobs need.
+DISK_RESERVE = int(os.environ.get('YTD_DISK_RESERVE_MB', 1024)) * 1024 * 1024
+# Estimates are raised by this share to cover container overhead and bitrate peaks.
+ESTIMATE_MARGIN = 0.1
+JANITOR_INTERVAL = int(os.environ.get('YTD_JANITOR_INTERVAL', 600))
+# Workspaces nobody wrote to for this long are abandoned, whoever owns them.
+ORPHAN_AGE = int(os.environ.get('YTD_ORPHAN_AGE', 6 * 3600))
+# While space is short, workspaces idle this long are reclaimed early, largest first.
+IDLE_AGE = int(os.environ.get('YTD_IDLE_AGE', 600))
+OWNER_FILE = '.owner'
+
+
+class InsufficientDiskSpace(RuntimeError):
+    pass
+
+
+def check_free_space(path, needed, reserve=DISK_RESERVE):
+    """Raise InsufficientDiskSpace unless path's filesystem has needed bytes plus the reserve free."""
+    free = shutil.disk_usage(path).free
+    if free - (needed or 0) < reserve:
+        wanted = f": about {format_bytes(needed)} needed" if needed else ""
+        raise InsufficientDiskSpace(
+            f"Not enough free disk space{wanted}, {format_bytes(max(free - reserve, 0))} available")
+
+
+def _usage(path):
+    # Bytes under path and the time of its last write
+    size, mtime = 0, os.path.getmtime(path)
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                st = os.stat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            size += st.st_size
+            mtime = max(mtime, st.st_mtime)
+    return size, mtime
+
+
+def _alive(pid):
+    if os.name == 'nt':
+        # No cheap liveness probe; such workspaces are reclaimed by age
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Workspace:
+    """A private directory for one job, removed with everything in it on close()."""
+
+    def __init__(self, manager, path, reserved):
+        self.manager = manager
+        self.path = path
+        self.reserved = reserved
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.manager._release(self)
+
+
+class WorkspaceManager:
+    """Per-job directories under one root, with disk admission and a janitor.
+
+    Each job downloads, merges and encodes in a directory of its own, so
+    files are never shared or picked up by another job, and finished files
+    are handed to the artifact cache from there. A job is admitted only
+    while the filesystem has room for its estimated peak size on top of
+    what admitted jobs have yet to write and DISK_RESERVE. Every directory
+    records its owner process; the janitor reclaims directories whose
+    owner is gone or that nobody wrote to for ORPHAN_AGE, and, when space
+    is short, ones idle for IDLE_AGE, largest first.
+    """
+
+    def __init__(self, root=WORKSPACE_DIR, reserve=DISK_RESERVE, orphan_age=ORPHAN_AGE,
+                 idle_age=IDLE_AGE, interval=JANITOR_INTERVAL):
+        self.root = root
+        self.reserve = reserve
+        self.orphan_age = orphan_age
+        self.idle_age = idle_age
+        self.interval = interval
+        self.rejected = 0
+        self.reclaimed = 0
+        self.reclaimed_bytes = 0
+        self._live = {}
+        self._janitor = None
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def create(self, name, estimate=None):
+        """Admit a job and return its Workspace; raises InsufficientDiskSpace if it does not fit."""
+        needed = int(estimate * (1 + ESTIMATE_MARGIN)) if estimate else 0
+        self.start_janitor()
+        try:
+            path = self._admit(name, needed)
+        except InsufficientDiskSpace:
+            # Abandoned workspaces may be holding the space
+            self.sweep(short=True)
+            try:
+                path = self._admit(name, needed)
+            except InsufficientDiskSpace:
+                with self._lock:
+                    self.rejected += 1
+                raise
+        return Workspace(self, path, needed)
+
+    def _admit(self, name, needed):
+        with self._lock:
+            check_free_space(self.root, needed + self._outstanding(), self.reserve)
+            path = tempfile.mkdtemp(prefix=f'{name}-', dir=self.root)
+            with open(os.path.join(path, OWNER_FILE), 'w', encoding='utf-8') as f:
+                json.dump({'pid': os.getpid(), 'created': time.time()}, f)
+            self._live[path] = needed
+            return path
+
+    def _outstanding(self):
+        # Bytes admitted jobs are still expected to write; the rest is already off the free count
+        total = 0
+        for path, reserved in self._live.items():
+            if reserved:
+                try:
+                    total += max(reserved - _usage(path)[0], 0)
+                except OSError:
+                    total += reserved
+        return total
+
+    def _release(self, workspace):
+        with self._lock:
+            self._live.pop(workspace.path, None)
+
+    def sweep(self, short=None):
+        """Remove abandoned workspaces; returns the bytes freed.
+
+        short defaults to whether free space is below the reserve.
+        """
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return 0
+        # Taken after the scan so a workspace admitted meanwhile counts as live
+        with self._lock:
+            live = set(self._live)
+        now = time.time()
+        candidates = []
+        for entry in entries:
+            if not entry.is_dir() or entry.path in live:
+                continue
+            try:
+                with open(os.path.join(entry.path, OWNER_FILE), encoding='utf-8') as f:
+                    pid = json.load(f).get('pid')
+            except (OSError, ValueError):
+                pid = None
+            try:
+                size, mtime = _usage(entry.path)
+            except OSError:
+                continue
+            # Our own closed workspaces, a dead owner or a long silence
+            abandoned = pid == os.getpid() or pid is None or not _alive(pid) or now - mtime > self.orphan_age
+            candidates.append((abandoned, now - mtime, size, entry.path))
+        if short is None:
+            short = shutil.disk_usage(self.root).free < self.reserve
+        freed = 0
+        for abandoned, idle, size, path in sorted(candidates, key=lambda c: -c[2]):
+            if abandoned or (short and idle > self.idle_age):
+                shutil.rmtree(path, ignore_errors=True)
+                freed += size
+                with self._lock:
+                    self.reclaimed += 1
+                    self.reclaimed_bytes += size
+        return freed
+
+    def start_janitor(self):
+        """Sweep now and then every interval, in a daemon thread, once per manager."""
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(target=self._run_janitor, name='workspace-janitor', daemon=True)
+        self._janitor.start()
+
+    def _run_janitor(self):
+        while True:
+            try:
+                self.sweep()
+            except OSError:
+                pass
+            time.sleep(self.interval)
+
+    def stats(self):
+        usage = shutil.disk_usage(self.root)
+        with self._lock:
+            return {
+                'live': len(self._live),
+                'outstanding_bytes': self._outstanding(),
+                'free_bytes': usage.free,
+                'rejected': self.rejected,
+                'reclaimed': self.reclaimed,
+                'reclaimed_bytes': self.reclaimed_bytes,
+            }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_workspaces():
+    """Return the process-wide workspace manager."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = WorkspaceManager()
+        return _manager
@@ -0,0 +1,131 @@
+import os
+import threading
+from contextlib import contextmanager
+
+POOL_SIZE = int(os.environ.get('YTD_YDL_POOL_SIZE', 4))
+# Single videos unless a caller asks for playlists (see playlist.iter_entries).
+BASE_OPTS = {'quiet': True, 'no_warnings': True, 'noplaylist': True}
+# Options that change how extractors log in or what they may touch; jobs
+# setting any of these get extractors of their own instead of warm ones.
+EXTRACTOR_OPTS = frozenset((
+    'username', 'password', 'videopassword', 'ap_username', 'ap_password', 'usenetrc',
+    'netrc_location', 'cookiefile', 'cookiesfrombrowser', 'extractor_args',
+    'allowed_extractors', 'geo_verification_proxy', 'proxy',
+))
+
+
+class YoutubeDLPool:
+    """Pre-initialised YoutubeDL instances shared by every session of the process.
+
+    Most of YoutubeDL's start-up goes into building its table of ~1700
+    extractor classes, so the table is built once and copied into each new
+    instance. Idle instances also keep their extractor objects, which hold
+    per-site state such as player caches. acquire() hands an instance to
+    one caller at a time; per-job options are applied on a fresh
+    instance that borrows the idle one's extractors for the duration.
+    """
+
+    def __init__(self, size=POOL_SIZE, base_opts=None):
+        self.size = size
+        self.base_opts = dict(BASE_OPTS if base_opts is None else base_opts)
+        self._idle = []
+        self._extractors = None
+        self._warming = False
+        self._lock = threading.Lock()
+        self._table_lock = threading.Lock()
+
+    def _extractor_table(self):
+        with self._table_lock:
+            if self._extractors is None:
+                from yt_dlp import YoutubeDL
+                self._extractors = YoutubeDL(dict(self.base_opts))._ies
+            return self._extractors
+
+    def create(self, opts=None):
+        """A YoutubeDL equivalent to YoutubeDL(opts), minus the extractor table rebuild."""
+        from yt_dlp import YoutubeDL
+        params = dict(opts if opts is not None else self.base_opts)
+        if 'allowed_extractors' in params:
+            return YoutubeDL(params)
+        table = self._extractor_table()
+        ydl = YoutubeDL(params, auto_init=False)
+        ydl._ies = dict(table)
+        return ydl
+
+    def warm(self, background=True):
+        """Import yt-dlp and fill one idle instance unless that already happened.
+
+        Cheap to call repeatedly, e.g. on every Streamlit rerun.
+        """
+        with self._lock:
+            if self._idle or self._warming:
+                return
+            self._warming = True
+
+        def fill():
+            try:
+                ydl = self.create()
+                with self._lock:
+                    if len(self._idle) < self.size:
+                        self._idle.append(ydl)
+            finally:
+                self._warming = False
+
+        if background:
+            threading.Thread(target=fill, name='ydl-warmup', daemon=True).start()
+        else:
+            fill()
+
+    @contextmanager
+    def acquire(self, opts=None):
+        """Yield a YoutubeDL for the base options, or for opts layered on top of them."""
+        with self._lock:
+            idle = self._idle.pop() if self._idle else None
+        if idle is None:
+            idle = self.create()
+        ydl, shared = idle, True
+        if opts:
+            ydl = self.create({**self.base_opts, **opts})
+            shared = not EXTRACTOR_OPTS.intersection(opts)
+            if shared:
+                self._lend(idle, ydl)
+        try:
+            yield ydl
+        finally:
+            if ydl is not idle:
+                if shared:
+                    self._lend(ydl, idle)
+                ydl.close()
+            self._release(idle)
+
+    @staticmethod
+    def _lend(owner, borrower):
+        # Extractor objects talk to whichever YoutubeDL they are bound to
+        for ie_key, ie in list(owner._ies_instances.items()):
+            ie.set_downloader(borrower)
+            borrower._ies_instances[ie_key] = ie
+        owner._ies_instances.clear()
+
+    def _release(self, ydl):
+        # Per-run counters and messages must not leak into the next caller
+        ydl._download_retcode = 0
+        ydl._num_downloads = 0
+        ydl._printed_messages.clear()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(ydl)
+                return
+        ydl.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide YoutubeDL pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = YoutubeDLPool()
+        return _pool
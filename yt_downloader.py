@@ -1,10 +1,28 @@
 import streamlit as st
-from yt_dlp import YoutubeDL
 import os
 import base64
 from io import BytesIO
 from datetime import datetime
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from metadata_cache import canonical_id, fetch_info, download_from_info, downloaded_path
+from artifact_cache import artifact_key, get_cache as get_artifact_cache
+from file_server import LINK_TTL, SIDECAR_PORT, file_url, start_server, stream_url, should_stream
+from jobs import QUEUED, FAILED, get_scheduler
+from progress import PROGRESS_RATE, ProgressAggregator, format_bytes, format_seconds
+from format_planner import FormatIndex
+from transcode import get_pipeline
+from range_download import download_format, is_rangeable
+from ydl_pool import get_pool
+from stream_pipe import PipedStream, can_stream
+from merge import download_and_merge
+from prefetch import get_prefetcher
+from clip import ClipSpec, can_clip
+from metrics import get_metrics, parse_profile
+from bandwidth import SOCKET_TIMEOUT, get_budget
+from workspace import get_workspaces
+from playlist import PLAYLIST_WORKERS, StreamingZip, is_playlist_url, iter_entries, playlist_key
 
 # Premium dark theme configuration
 st.set_page_config(
@@ -14,6 +32,18 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# yt-dlp loads in the background while the page renders, so the first job finds it ready
+get_pool().warm()
+
+# Large files, direct streams, playlist ZIPs and /metrics are served by the
+# sidecar. Its links only resolve in the process that made them, so if the
+# port is taken everything is served through the page instead.
+try:
+    start_server()
+    sidecar_error = None
+except OSError as e:
+    sidecar_error = e
+
 # Premium CSS styling
 st.markdown("""
 <style>
@@ -163,240 +193,392 @@ with st.container():
                 ["320kbps (Best)", "256kbps", "192kbps", "128kbps"],
                 index=0
             )
+    
+    stream_mode = st.checkbox(
+        "Stream directly (nothing is stored on the server)",
+        value=False,
+        disabled=sidecar_error is not None,
+        help="Sends the file to your browser while it downloads. Only available when "
+             "no separate video and audio streams have to be merged."
+    )
+    
+    # Playlist links can be downloaded entry by entry into one ZIP
+    playlist_mode = is_playlist_url(url) and st.checkbox(
+        "Download the whole playlist",
+        value=False,
+        disabled=sidecar_error is not None,
+        help="Every entry is downloaded with the options above and delivered as one ZIP "
+             "that starts while the remaining entries are still being processed."
+    )
+    
+    # Only the bytes covering the requested window are fetched
+    clip_mode = not playlist_mode and st.checkbox(
+        "Download only part of the video",
+        value=False,
+        help="Give start and/or end times, or part of a chapter title. A short clip of "
+             "a long video downloads in about the time the clip itself would."
+    )
+    if clip_mode:
+        clip_col1, clip_col2, clip_col3 = st.columns(3)
+        with clip_col1:
+            clip_start = st.text_input("Start:", placeholder="1:30")
+        with clip_col2:
+            clip_end = st.text_input("End:", placeholder="2:00")
+        with clip_col3:
+            clip_chapter = st.text_input("Or chapter:", placeholder="Part of the chapter title")
+        clip_precise = st.checkbox(
+            "Cut exactly at these times",
+            value=False,
+            help="Re-encodes the clip. Without it cuts snap to the nearest keyframe, "
+                 "which is much faster and keeps the original quality."
+        )
+
+# Targets the format planner works towards
+resolution_heights = {
+    "720p (Best)": 720,
+    "4K": 2160,
+    "1080p": 1080,
+    "720p": 720,
+    "480p": 480,
+    "360p": 360,
+    "144p": 144,
+}
+quality_map = {
+    "320kbps (Best)": "320",
+    "256kbps": "256",
+    "192kbps": "192",
+    "128kbps": "128"
+}
+
+clip, clip_error = None, None
+if clip_mode:
+    try:
+        clip = ClipSpec.parse(clip_start, clip_end, clip_chapter, clip_precise)
+    except ValueError as e:
+        clip_error = str(e)
+
+# Each browser session follows one prefetch; a new URL drops the previous one
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
 
 # File info section
-if url and len(url) > 20:
-    with st.container():
+if url and len(url) > 20 and not playlist_mode:
+    # Extraction starts in the background as soon as the URL is entered;
+    # the panel polls for it without blocking the rest of the page
+    prefetch = get_prefetcher().request(session_id, url)
+    polling = not prefetch.done()
+    
+    @st.fragment(run_every=1 / PROGRESS_RATE if polling else None)
+    def info_panel():
+        if not prefetch.done():
+            st.info("Fetching video details...")
+            return
+        if polling:
+            # Rerun the whole page once so this panel stops polling
+            st.rerun()
+            return
+        # Real sizes come from the formats of this video; the job reuses the cached info
+        try:
+            info = prefetch.result()
+            format_index = FormatIndex.from_info(info)
+        except Exception:
+            info, format_index = None, None
+        
+        if download_type == "Video":
+            plan = format_index.plan_video(resolution_heights[resolution]) if format_index else None
+        else:
+            plan = format_index.plan_audio('mp3', int(quality_map[audio_quality])) if format_index else None
+        size = plan.output_size if plan else None
+        clip_line = ""
+        if clip is not None and info is not None:
+            # Only the window is transferred, so the estimate shrinks with it
+            try:
+                clip_line = f"- Clip: {clip.label(info)}"
+                size = int(size * clip.fraction(info)) if size else size
+            except ValueError as e:
+                clip_line = f"- Clip: {e}"
+        
         if download_type == "Video":
-            size_estimates = {
-                "8K": "800MB - 3GB (10-30 min video)",
-                "4K": "300MB - 1.5GB (10-30 min video)",
-                "1440p": "150MB - 800MB (10-30 min video)",
-                "1080p": "80MB - 500MB (10-30 min video)",
-                "720p (Best)": "50MB - 300MB (10-30 min video)",
-                "720p": "50MB - 300MB (10-30 min video)",
-                "480p": "20MB - 150MB (10-30 min video)",
-                "360p": "10MB - 80MB (10-30 min video)",
-                "144p": "5MB - 30MB (10-30 min video)"
-            }
+            quality = f"{resolution} ({plan.height}p available)" if plan and plan.height else resolution
             st.info(f"""
             **Estimated Download Information**
             
-            - Quality: {resolution}
-            - File size: {size_estimates[resolution]}
-            - Format: MP4 (H.264/AAC)
+            - Quality: {quality}
+            - File size: {format_bytes(size) if size else 'Unknown'}
+            - Format: {plan.describe() if plan else 'MP4 (H.264/AAC)'}
+            {clip_line}
             """)
         else:
             st.info(f"""
             **Estimated Download Information**
             
             - Audio quality: {audio_quality}
-            - File size: 3-10MB per minute
-            - Format: MP3 (ID3 tags included)
+            - File size: {format_bytes(size) if size else 'Unknown'}
+            - Format: {plan.describe() if plan else 'MP3'} (ID3 tags included)
+            {clip_line}
             """)
+    
+    with st.container():
+        info_panel()
+
+
+def run_download(job, url, target, ydl_opts, download_type, profile=()):
+    """Produce (or fetch from cache) the file for one download job.
+
+    target is the requested height for videos or codec/bitrate for audio,
+    plus the clip window if any; the format planner turns it into concrete
+    formats once info is known. profile names the profilers to run for
+    this job ('cpu', 'memory').
+    Runs on a scheduler worker thread, so it only reports through the job
+    object and never touches Streamlit elements directly.
+    """
+    progress = ProgressAggregator(lambda snapshot: job.update(**snapshot))
+    trace = job.trace
+    trace.label = url
+    trace.start_profile(profile)
+
+    def hook(d):
+        progress.hook(d)
+        trace.hook(d)
+
+    def postprocessor_hook(d):
+        # Merging and audio extraction are CPU bound, hand the network slot back
+        if d['status'] == 'started':
+            job.enter('cpu')
+        progress.postprocessor_hook(d)
+        trace.postprocessor_hook(d)
+
+    ydl_opts = dict(ydl_opts, progress_hooks=[hook], postprocessor_hooks=[postprocessor_hook],
+                    logger=trace.logger)
+    cleanup_started = None
+    clip = ClipSpec(**target['clip']) if target.get('clip') else None
+    artifacts = get_artifact_cache()
+    # Finished jobs keep pointing at the entry while a refresh can still reattach
+    with artifacts.producing(artifact_key(canonical_id(url), target), keep_for=scheduler.retention) as entry:
+        if not entry.hit:
+            job.enter('network')
+            # First extract info so the page can warn about long videos
+            with trace.phase('extract'):
+                info = fetch_info(url, ydl_opts)
+            job.info = info
+            trace.label = info.title or url
+            
+            format_index = FormatIndex.from_info(info)
+            if download_type == "Video":
+                plan = format_index.plan_video(target['height'])
+            else:
+                plan = format_index.plan_audio(target['codec'], target['bitrate'])
+            if plan is None:
+                raise ValueError("No suitable format found for the selected quality")
+            # Separate video and audio streams are merged into one figure
+            progress.expected_streams = len(plan.formats)
+            progress.postprocess = plan.merge or bool(plan.postprocessors)
+            outtmpl = '%(title)s.%(ext)s'
+            if clip is not None:
+                # ffmpeg fetches every stream of the window in one run, no separate merge
+                job.update(clip_duration=clip.length(info))
+                progress.expected_streams = 1
+                progress.postprocess = bool(plan.postprocessors)
+                ydl_opts.update(clip.ydl_opts(info))
+                outtmpl = f'%(title)s [{clip.label(info)}].%(ext)s'
+            
+            # Everything the job writes stays in a directory of its own,
+            # admitted only if its estimated size fits on disk
+            estimate = plan.disk_bytes()
+            if estimate and clip is not None:
+                estimate = int(estimate * clip.fraction(info))
+            with get_workspaces().create(job.id[:12], estimate) as workspace:
+                # Audio is encoded by the shared transcoder pool instead of yt-dlp's postprocessors
+                transcode = download_type == "MP3 Audio"
+                ydl_opts.update(plan.ydl_opts(postprocess=not transcode))
+                ydl_opts['outtmpl'] = os.path.join(workspace.path, outtmpl)
+                download_start = time.time()
+                fmt = plan.formats[0]
+                # Streams yt-dlp fetches itself are tuned through ydl.params while they run
+                with get_budget().controller(fmt.get('url')) as controller:
+                    ydl_opts.update(controller.ydl_opts(bool(fmt.get('fragments'))), progress_hooks=[hook, controller.hook])
+                    with get_pool().acquire(ydl_opts) as ydl:
+                        controller.attach(ydl.params)
+                        if clip is None and not plan.merge and is_rangeable(fmt, ydl.params) and not ydl_opts.get('postprocessors'):
+                            # Single progressive file: fetch it as parallel byte ranges
+                            filename = download_format(ydl, info, fmt, progress_hook=hook)
+                        elif clip is None and plan.merge:
+                            # Video and audio come down side by side and are merged in one pass
+                            filename = download_and_merge(ydl, info, plan, hook, postprocessor_hook)
+                        else:
+                            # Start the actual download, reusing the extracted info; yt-dlp
+                            # reports the final path, postprocessors included
+                            filename = downloaded_path(ydl, download_from_info(ydl, info))
+            
+                if transcode:
+                    # Free the network slot so the next download starts while this one encodes
+                    job.enter('cpu')
+                    progress.postprocessor_hook({'status': 'started'})
+                    timing = get_pipeline().submit(filename, plan, info, time.time() - download_start).result()
+                    progress.postprocessor_hook({'status': 'finished'})
+                    trace.add_wait('transcode', timing['queue_wait'])
+                    trace.add('transcode', timing['encode'])
+                    job.update(timings=timing)
+                    filename = timing['output']
+            
+                if not os.path.exists(filename):
+                    raise FileNotFoundError("Downloaded file not found")
+            
+                # Move the finished file into the shared cache
+                with trace.phase('handoff'):
+                    entry.publish(filename, info)
+                cleanup_started = time.perf_counter()
+    if cleanup_started is not None:
+        # Leaving the workspace removes the partial and intermediate files
+        trace.add('cleanup', time.perf_counter() - cleanup_started)
+    progress.finish()
+    return {
+        'filename': entry.path,
+        'info': entry.info,
+        'cache_hit': entry.hit,
+        'download_type': download_type,
+        'timings': job.progress.get('timings'),
+        'phases': trace.summary(),
+    }
+
+
+def run_playlist(job, url, target, ydl_opts, download_type):
+    """Download every entry of a playlist into one streaming ZIP.
+
+    Entries are listed lazily and shown as each page arrives. Every entry
+    runs through run_download as its own tracked job, PLAYLIST_WORKERS at
+    a time, so cached and in-flight videos are shared with single downloads.
+    The ZIP link works from the start and grows as entries finish.
+    """
+    archive = StreamingZip(f"playlist-{job.id[:8]}.zip", get_artifact_cache())
+    entries = []
+    job.update(entries=entries, listing=True, zip_url=stream_url(archive), done=0, failed=0)
+
+    def counts():
+        return {status: sum(e['status'] == status for e in entries) for status in ('done', 'failed')}
+
+    def download(entry):
+        entry['status'] = 'downloading'
+        child = scheduler.run(
+            artifact_key(canonical_id(entry['url']), target),
+            run_download, entry['url'], target, ydl_opts, download_type,
+        )
+        if child.status == FAILED:
+            entry['status'] = 'failed'
+        else:
+            archive.add(child.result['filename'], os.path.basename(child.result['filename']))
+            entry['status'] = 'done'
+        job.update(**counts())
+
+    try:
+        with ThreadPoolExecutor(PLAYLIST_WORKERS) as pool:
+            for entry in iter_entries(url):
+                entry['status'] = 'queued'
+                entries.append(entry)
+                pool.submit(download, entry)
+            job.update(listing=False)
+    finally:
+        archive.close()
+    result = counts()
+    if entries and not result['done']:
+        raise RuntimeError("None of the playlist entries could be downloaded")
+    return {'download_type': download_type, 'playlist': True, **result}
+
+
+scheduler = get_scheduler()
+
+# Live state next to the per-job figures on the sidecar's /metrics
+metrics = get_metrics()
+metrics.gauge('ytd_jobs', 'Jobs by status.', scheduler.stats)
+metrics.gauge('ytd_artifact_cache', 'Artifact cache counters and size.', lambda: get_artifact_cache().stats())
+metrics.gauge('ytd_prefetch', 'Metadata prefetches in flight and failed.', lambda: get_prefetcher().stats())
+metrics.gauge('ytd_node', 'Connections and bandwidth shared by all downloads.', lambda: get_budget().stats())
+metrics.gauge('ytd_workspaces', 'Job workspaces, disk admission and janitor.', lambda: get_workspaces().stats())
+if sidecar_error is not None:
+    st.error(f"""
+    The file server could not listen on port {SIDECAR_PORT} ({sidecar_error}).
+    Downloads are offered through this page only: direct streaming, playlist ZIPs
+    and /metrics are unavailable until the port is free again.
+    """)
 
 # Premium download button
 if st.button("✨ Process Download", type="primary"):
     if url:
         try:
-            # Temporary directory for processing
-            temp_dir = "temp_downloads"
-            if not os.path.exists(temp_dir):
-                os.makedirs(temp_dir)
-
-            # Configure premium download options
+            # Configure premium download options; formats are planned per video
             if download_type == "Video":
-                format_selector = {
-                    "720p (Best)": "bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<=720]",
-                    "4K": "bestvideo[height<=2160][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<=2160]",
-                    "1080p": "bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<=1080]",
-                    "720p": "bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<=720]",
-                    "480p": "bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<=480]",
-                    "360p": "bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<=360]",
-                    "144p": "bestvideo[height<=144][ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4][height<=144]",
-                }
-                
+                target = {'height': resolution_heights[resolution]}
                 ydl_opts = {
-                    'format': format_selector[resolution],
-                    'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-                    'merge_output_format': 'mp4',
                     'retries': 10,
                     'fragment_retries': 10,
                     'quiet': True,
+                    'noprogress': True,
                     'no_color': True,
                     'noplaylist': True,
                     'extract_flat': False,
-                    'concurrent_fragment_downloads': 4,
-                    'socket_timeout': 300,
-                    'buffersize': 1024 * 1024 * 16,  # 16MB buffer size
+                    # Fragment concurrency and buffer size are set per download from measured throughput
+                    'socket_timeout': SOCKET_TIMEOUT,
                 }
             else:
-                quality_map = {
-                    "320kbps (Best)": "320",
-                    "256kbps": "256",
-                    "192kbps": "192",
-                    "128kbps": "128"
-                }
-                
+                target = {'codec': 'mp3', 'bitrate': int(quality_map[audio_quality])}
                 ydl_opts = {
-                    'format': 'bestaudio/best',
-                    'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': quality_map[audio_quality],
-                    }, {
-                        'key': 'FFmpegMetadata',
-                        'add_metadata': True,
-                    }],
                     'retries': 10,
                     'quiet': True,
+                    'noprogress': True,
                     'no_color': True,
                     'noplaylist': True,
                     'extract_flat': False,
-                    'extractaudio': True,
-                    'socket_timeout': 300,
+                    'socket_timeout': SOCKET_TIMEOUT,
                 }
+            if clip_error:
+                raise ValueError(clip_error)
+            if clip is not None:
+                if not can_clip():
+                    raise RuntimeError("Downloading part of a video needs FFmpeg on the server")
+                target['clip'] = clip.key()
 
-            with st.spinner("Processing premium download..."):
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                timer_text = st.empty()
-                start_time = time.time()
-                
-                def progress_hook(d):
-                    if d['status'] == 'downloading':
-                        # Get percentage and speed
-                        percent = d.get('_percent_str', '0%')
-                        percent_float = float(percent.strip('%')) / 100
-                        speed = d.get('_speed_str', 'N/A')
-                        eta = d.get('_eta_str', 'N/A')
-                        
-                        # Update progress bar
-                        progress_bar.progress(percent_float)
-                        
-                        # Calculate elapsed time
-                        elapsed = time.time() - start_time
-                        elapsed_str = time.strftime("%H:%M:%S", time.gmtime(elapsed))
-                        
-                        # Update status text
-                        status_text.markdown(f"""
-                        <div class="progress-info">
-                            <span>Progress: {percent}</span>
-                            <span>Speed: {speed}</span>
-                            <span>ETA: {eta}</span>
-                            <span>Elapsed: {elapsed_str}</span>
-                        </div>
-                        """, unsafe_allow_html=True)
-                        
-                    elif d['status'] == 'finished':
-                        progress_bar.progress(1.0)
-                        elapsed = time.time() - start_time
-                        elapsed_str = time.strftime("%H:%M:%S", time.gmtime(elapsed))
-                        status_text.markdown(f"""
-                        <div class="progress-info">
-                            <span>Processing completed in: {elapsed_str}</span>
-                        </div>
-                        """, unsafe_allow_html=True)
-                
-                ydl_opts['progress_hooks'] = [progress_hook]
+            stream = None
+            if playlist_mode:
+                job = scheduler.submit(
+                    playlist_key(url, target),
+                    run_playlist, url, target, ydl_opts, download_type,
+                )
+                st.query_params["job"] = job.id
+            elif stream_mode and clip is not None:
+                st.info("Clips are cut on the server, so this one is prepared there instead of streamed.")
+            elif stream_mode:
+                info = fetch_info(url)
+                format_index = FormatIndex.from_info(info)
+                if download_type == "Video":
+                    plan = format_index.plan_video(target['height'])
+                else:
+                    plan = format_index.plan_audio(target['codec'], target['bitrate'])
+                if can_stream(plan):
+                    stream = PipedStream(plan, info)
+                else:
+                    st.info("This quality needs separate video and audio streams merged, "
+                            "so it is prepared on the server instead.")
+
+            if stream is not None:
+                # The sidecar fetches (and converts) while the browser downloads
+                st.success("""
+                ### ✅ Stream Ready
                 
-                with YoutubeDL(ydl_opts) as ydl:
-                    try:
-                        # First extract info to check video duration
-                        info = ydl.extract_info(url, download=False)
-                        duration = info.get('duration', 0)  # in seconds
-                        
-                        # Show warning if video is longer than 30 minutes
-                        if duration > 1800:  # 30 minutes
-                            st.warning(f"""
-                            ⚠️ Long Video Warning ({(duration//60)} minutes)
-                            
-                            For best results with long videos:
-                            1. Choose a lower resolution (720p or below)
-                            2. Ensure stable internet connection
-                            3. Don't close the browser during download
-                            
-                            The download may take several minutes to complete.
-                            """)
-                        
-                        # Start the actual download
-                        info = ydl.extract_info(url, download=True)
-                        filename = ydl.prepare_filename(info)
-                        
-                        if download_type == "MP3 Audio":
-                            base_filename = os.path.splitext(filename)[0]
-                            filename = f"{base_filename}.mp3"
-                        
-                        # Verify file exists
-                        if not os.path.exists(filename):
-                            for f in os.listdir(temp_dir):
-                                if f.startswith(os.path.splitext(os.path.basename(filename))[0]):
-                                    filename = os.path.join(temp_dir, f)
-                                    break
-                        
-                        if not os.path.exists(filename):
-                            raise FileNotFoundError("Downloaded file not found")
-                        
-                        # Get file info
-                        file_size = os.path.getsize(filename)
-                        size_mb = file_size / (1024 * 1024)
-                        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        
-                        # Show premium download section
-                        st.success("""
-                        ### ✅ Download Ready
-                        
-                        Your premium download has been processed successfully.
-                        """)
-                        
-                        # Create a download button that serves the file directly
-                        with open(filename, "rb") as file:
-                            btn = st.download_button(
-                                label=f"⬇️ Download {download_type} ({size_mb:.1f}MB)",
-                                data=file,
-                                file_name=os.path.basename(filename),
-                                mime="video/mp4" if download_type == "Video" else "audio/mp3",
-                            )
-                        
-                        # File details in expandable section
-                        with st.expander("📁 Download Details", expanded=True):
-                            thumbnail_url = info.get('thumbnail', '')
-                            if thumbnail_url:
-                                st.image(thumbnail_url, width=300)
-                            
-                            st.markdown(f"""
-                            **File Information**
-                            - Name: `{os.path.basename(filename)}`
-                            - Type: `{download_type}`
-                            - Size: `{size_mb:.2f} MB`
-                            - Processed: `{timestamp}`
-                            
-                            **Video Information**
-                            - Title: `{info.get('title', 'N/A')}`
-                            - Duration: `{info.get('duration_string', 'N/A')}`
-                            - Views: `{info.get('view_count', 'N/A')}`
-                            - Uploader: `{info.get('uploader', 'N/A')}`
-                            """)
-                        
-                    except Exception as e:
-                        st.error(f"""
-                        ### ❌ Processing Error
-                        
-                        {str(e)}
-                        
-                        Please try again or contact support if the problem persists.
-                        """)
-                    finally:
-                        # Clean up
-                        try:
-                            if 'filename' in locals() and os.path.exists(filename):
-                                os.remove(filename)
-                        except:
-                            pass
-                        progress_bar.empty()
-                        status_text.empty()
-                        timer_text.empty()
+                The download starts when you open the link.
+                """)
+                st.link_button(
+                    label=f"⬇️ Download {download_type} ({plan.describe()})",
+                    url=stream_url(stream),
+                )
+            elif not playlist_mode:
+                # Identical requests from other sessions join the same job
+                job = scheduler.submit(
+                    artifact_key(canonical_id(url), target),
+                    run_download, url, target, ydl_opts, download_type,
+                    # ?profile=cpu,memory captures profiles for this job
+                    profile=parse_profile(st.query_params.get("profile")),
+                )
+                # Remember the job in the URL so a refresh reattaches to it
+                st.query_params["job"] = job.id
 
         except Exception as e:
             st.error(f"""
@@ -414,6 +596,211 @@ if st.button("✨ Process Download", type="primary"):
     else:
         st.warning("Please enter a valid YouTube URL")
 
+# Progress and result of the job this page is attached to
+job = scheduler.get(st.query_params.get("job", ""))
+if job is not None and job.key.startswith("playlist:"):
+    with st.spinner("Processing playlist..."):
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        link_slot = st.empty()
+        entries_table = st.empty()
+        linked = False
+        shown = None
+        while True:
+            finished = job.wait(1 / PROGRESS_RATE)
+            snapshot = job.progress
+            entries = snapshot.get('entries', [])
+            processed = snapshot.get('done', 0) + snapshot.get('failed', 0)
+            if snapshot.get('zip_url') and not linked:
+                linked = True
+                link_slot.link_button("⬇️ Download ZIP (grows as entries finish)", url=snapshot['zip_url'])
+            progress_bar.progress(processed / len(entries) if entries else 0.0)
+            more = " (listing more...)" if snapshot.get('listing') else ""
+            status_text.markdown(f"**{processed} of {len(entries)} entries processed**{more}")
+            # Only redraw the table when something changed
+            state = (len(entries), processed, sum(e['status'] == 'downloading' for e in entries))
+            if state != shown:
+                shown = state
+                entries_table.dataframe(
+                    [{'Title': e['title'], 'Status': e['status']} for e in entries],
+                    use_container_width=True, hide_index=True,
+                )
+            if finished:
+                break
+        progress_bar.empty()
+    
+    if job.status == FAILED:
+        st.error(f"""
+        ### ❌ Playlist Error
+        
+        {str(job.error)}
+        """)
+    else:
+        st.success(f"""
+        ### ✅ Playlist Ready
+        
+        {job.result['done']} entries downloaded, {job.result['failed']} failed.
+        """)
+elif job is not None:
+    with st.spinner("Processing premium download..."):
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        timer_text = st.empty()
+        start_time = job.created
+        warned = False
+        
+        try:
+            while True:
+                finished = job.wait(1 / PROGRESS_RATE)
+                info = job.info
+                duration = job.progress.get('clip_duration') or (info.duration if info else 0) or 0  # in seconds
+                
+                # Show warning if video is longer than 30 minutes
+                if not warned and duration > 1800:  # 30 minutes
+                    warned = True
+                    st.warning(f"""
+                    ⚠️ Long Video Warning ({(duration//60)} minutes)
+                    
+                    For best results with long videos:
+                    1. Choose a lower resolution (720p or below)
+                    2. Ensure stable internet connection
+                    3. Don't close the browser during download
+                    
+                    The download may take several minutes to complete.
+                    """)
+                
+                # Calculate elapsed time
+                elapsed = (job.finished or time.time()) - start_time
+                elapsed_str = time.strftime("%H:%M:%S", time.gmtime(elapsed))
+                
+                if finished:
+                    progress_bar.progress(1.0)
+                    status_text.markdown(f"""
+                    <div class="progress-info">
+                        <span>Processing completed in: {elapsed_str}</span>
+                    </div>
+                    """, unsafe_allow_html=True)
+                    break
+                
+                if job.status == QUEUED or 'fraction' not in job.progress:
+                    status_text.markdown(f"""
+                    <div class="progress-info">
+                        <span>Waiting for a free worker...</span>
+                        <span>Elapsed: {elapsed_str}</span>
+                    </div>
+                    """, unsafe_allow_html=True)
+                    continue
+                
+                # Get percentage and speed from the raw byte counts
+                snapshot = job.progress
+                percent_float = snapshot['fraction']
+                speed = f"{format_bytes(snapshot['speed'])}/s" if snapshot['speed'] else 'N/A'
+                eta = format_seconds(snapshot['eta'])
+                
+                # Update progress bar
+                progress_bar.progress(percent_float)
+                
+                # Update status text
+                if snapshot['phase'] == 'postprocessing':
+                    status_text.markdown(f"""
+                    <div class="progress-info">
+                        <span>Progress: {percent_float:.1%}</span>
+                        <span>Converting...</span>
+                        <span>Elapsed: {elapsed_str}</span>
+                    </div>
+                    """, unsafe_allow_html=True)
+                else:
+                    status_text.markdown(f"""
+                    <div class="progress-info">
+                        <span>Progress: {percent_float:.1%}</span>
+                        <span>Speed: {speed}</span>
+                        <span>ETA: {eta}</span>
+                        <span>Elapsed: {elapsed_str}</span>
+                    </div>
+                    """, unsafe_allow_html=True)
+        finally:
+            progress_bar.empty()
+            status_text.empty()
+            timer_text.empty()
+    
+    if job.status == FAILED:
+        st.error(f"""
+        ### ❌ Processing Error
+        
+        {str(job.error)}
+        
+        Please try again or contact support if the problem persists.
+        """)
+    elif not os.path.exists(job.result['filename']):
+        # Evicted from the artifact cache once nothing pinned it any more
+        st.warning("This download has expired, please run it again.")
+    else:
+        result = job.result
+        filename, info = result['filename'], result['info']
+        job_type = result['download_type']
+        
+        # Get file info
+        file_size = os.path.getsize(filename)
+        size_mb = file_size / (1024 * 1024)
+        timestamp = datetime.fromtimestamp(job.finished).strftime("%Y-%m-%d %H:%M:%S")
+        
+        # Show premium download section
+        st.success("""
+        ### ✅ Download Ready
+        
+        Your premium download has been processed successfully.
+        """)
+        
+        mime = "video/mp4" if job_type == "Video" else "audio/mp3"
+        if sidecar_error is None and should_stream(filename):
+            # Large files are streamed from disk by the sidecar
+            # instead of being held in memory by Streamlit
+            # The link outlives the job, so the file stays in the cache as long
+            get_artifact_cache().pin(filename, LINK_TTL)
+            st.link_button(
+                label=f"⬇️ Download {job_type} ({size_mb:.1f}MB)",
+                url=file_url(filename, mime=mime),
+            )
+        else:
+            # Create a download button that serves the file directly
+            with open(filename, "rb") as file:
+                btn = st.download_button(
+                    label=f"⬇️ Download {job_type} ({size_mb:.1f}MB)",
+                    data=file,
+                    file_name=os.path.basename(filename),
+                    mime=mime,
+                )
+        
+        # File details in expandable section
+        with st.expander("📁 Download Details", expanded=True):
+            thumbnail_url = info.thumbnail
+            if thumbnail_url:
+                st.image(thumbnail_url, width=300)
+            
+            cache_stats = get_artifact_cache().stats()
+            timings = result['timings']
+            encode_line = (
+                f"- Encoding: `{timings['encode']:.1f}s` (queued `{timings['queue_wait']:.1f}s`)"
+                if timings else ""
+            )
+            phases_line = f"- Phases: `{result['phases']}`" if result.get('phases') else ""
+            st.markdown(f"""
+            **File Information**
+            - Name: `{os.path.basename(filename)}`
+            - Type: `{job_type}`
+            - Size: `{size_mb:.2f} MB`
+            - Processed: `{timestamp}`
+            - Served from cache: `{'Yes' if result['cache_hit'] else 'No'}` ({cache_stats['hits']} hits / {cache_stats['misses']} misses)
+            {encode_line}
+            {phases_line}
+            
+            **Video Information**
+            - Title: `{info.title or 'N/A'}`
+            - Duration: `{info.duration_string or 'N/A'}`
+            - Views: `{info.view_count or 'N/A'}`
+            - Uploader: `{info.uploader or 'N/A'}`
+            """)
+
 # Premium footer
 st.markdown("---")
 st.markdown("""